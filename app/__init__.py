@@ -1,26 +1,44 @@
-from flask import Flask
 from werkzeug.exceptions import HTTPException
 
 from .config import get_config
+from .serialization import App, init_app as init_serialization
 from .models import init_app as init_db
 from .auth import init_app as init_auth, bp as auth_bp
+from .likes import init_app as init_likes
+from .feed import init_app as init_feed
+from .sqltrace import init_app as init_sqltrace
+from .metrics import init_app as init_metrics
+from .replicas import init_app as init_replicas
 from .post import bp as post_bp
+from .batch import bp as batch_bp
+from . import cache
 
 
 def create_app(config_name):
-    app = Flask(__name__)
+    app = App(__name__)
     app.config.from_object(get_config(config_name))
 
+    init_serialization(app)
     init_db(app)
     init_auth(app)
+    init_likes(app)
+    init_feed(app)
+    init_sqltrace(app)
+    init_metrics(app)
+    init_replicas(app)
 
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(post_bp, url_prefix='/posts')
+    app.register_blueprint(batch_bp, url_prefix='/batch')
 
     @app.route('/health')
     def health():       #pylint:disable=W0612
         return '', 204
 
+    @app.route('/cache/stats')
+    def cache_stats():     #pylint:disable=W0612
+        return cache.stats()
+
     @app.errorhandler(HTTPException)
     def handle_error(e):    #pylint:disable=W0612
         return {
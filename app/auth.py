@@ -22,15 +22,30 @@ import jwt
 from .oauth2 import (
     GoogleOAuth2Client,
     FacebookOAuth2Client,
+    ProviderError,
 )
-from .models import User
+from .identity import IdentityCache
+from .tokens import TokenStore, cli as tokens_cli
+from .models import (
+    User,
+    db,
+    on_save,
+)
+
+
+ACCESS_TOKEN_LIFETIME = 60 * 60 * 24
 
+LINK_TOKEN_LIFETIME = 60 * 5
 
 login_manager = LoginManager()
 redis = None
+token_store = None
+identity_cache = None
 
 def init_app(app):
     login_manager.init_app(app)
+    GoogleOAuth2Client.configure(app.config)
+    FacebookOAuth2Client.configure(app.config)
 
     global redis
     if app.testing:
@@ -40,6 +55,20 @@ def init_app(app):
         from redis import Redis
         redis = Redis.from_url(app.config['REDIS_URL'])
 
+    global token_store
+    token_store = TokenStore(redis, max_ttl=ACCESS_TOKEN_LIFETIME)
+    app.cli.add_command(tokens_cli)
+
+    global identity_cache
+    identity_cache = None
+    if app.config['IDENTITY_CACHE_ENABLED']:
+        identity_cache = IdentityCache(
+            redis,
+            maxsize=app.config['IDENTITY_CACHE_SIZE'],
+            ttl=app.config['IDENTITY_CACHE_TTL'],
+            listen=not app.testing,
+        )
+
 
 @login_manager.request_loader
 def load_user_from_request(request):
@@ -47,7 +76,20 @@ def load_user_from_request(request):
     if not token:
         token = request.headers.get('authorization', '').replace('Bearer', '').strip()
 
-    if not (token and redis.sismember('alive_token', token)):
+    if not token:
+        return None
+
+    if identity_cache is not None:
+        user = identity_cache.get(token)
+        if user is not None:
+            return db.session.merge(user, load=False)     #pylint:disable=E1101
+
+    # a cached entry expires with its token at the latest
+    ttl = token_store.get_ttl(token)
+    if ttl is None:
+        # issued before the per-token keys, `flask tokens migrate` may not have run yet
+        ttl = token_store.migrate_legacy_token(token, current_app.config['SECRET_KEY'])
+    if ttl is None:
         return None
 
     try:
@@ -56,9 +98,17 @@ def load_user_from_request(request):
         return None
 
     user = User.query.get(payload['id'])
+    if user is not None and identity_cache is not None:
+        identity_cache.set(token, user, ttl=ttl)
     return user
 
 
+@on_save
+def invalidate_identity_on_save(instance):
+    if isinstance(instance, User) and identity_cache is not None:
+        identity_cache.invalidate_user(instance.id)
+
+
 def validate_state(state):
     supported_providers = ('google', 'facebook')
     supported_actions = ('login', 'register')
@@ -88,10 +138,10 @@ def handle_login(provider, userinfo, token_generator):
         'name': user.name,
         'email': user.email,
         'iss': datetime.now().timestamp(),
-        'iat': 1000 * 60 * 60 * 24,
+        'iat': 1000 * ACCESS_TOKEN_LIFETIME,
     })
 
-    redis.sadd('alive_token', token)
+    token_store.add(token, user.id, ACCESS_TOKEN_LIFETIME)
 
     return {
         'access_token': token,
@@ -113,9 +163,9 @@ def handle_register(provider, userinfo, token_generator):
                 'name': user.name,
                 'email': user.email,
                 'iss': datetime.now().timestamp(),
-                'iat': 1000 * 60 * 5,
+                'iat': 1000 * LINK_TOKEN_LIFETIME,
             })
-            redis.sadd('alive_token', token)
+            token_store.add(token, user.id, LINK_TOKEN_LIFETIME)
 
             return {
                 'message': f'Email {userinfo["email"]} was used by {user.name}. Do you link to the {provider} account',
@@ -174,21 +224,24 @@ def oauth_callback():
 
     provider = state['provider']
     code = request.args.get('code', type=str)
-    if provider == 'google':
-        userinfo = GoogleOAuth2Client.get_userinfo(
-            current_app.config['GOOGLE_CLIENT_ID'],
-            current_app.config['GOOGLE_CLIENT_SECRET'],
-            code,
-            request.url,
-        )
-
-    elif provider == 'facebook':
-        userinfo = FacebookOAuth2Client.get_userinfo(
-            current_app.config['FACEBOOK_CLIENT_ID'],
-            current_app.config['FACEBOOK_CLIENT_SECRET'],
-            code,
-            request.url,
-        )
+    try:
+        if provider == 'google':
+            userinfo = GoogleOAuth2Client.get_userinfo(
+                current_app.config['GOOGLE_CLIENT_ID'],
+                current_app.config['GOOGLE_CLIENT_SECRET'],
+                code,
+                request.url,
+            )
+
+        elif provider == 'facebook':
+            userinfo = FacebookOAuth2Client.get_userinfo(
+                current_app.config['FACEBOOK_CLIENT_ID'],
+                current_app.config['FACEBOOK_CLIENT_SECRET'],
+                code,
+                request.url,
+            )
+    except ProviderError as e:
+        abort(503, str(e))
 
     action = state.get('action')
     if action == 'login':
@@ -226,7 +279,20 @@ def link_account():
 @login_required
 def logout():
     token = request.headers.get('authorization').replace('Bearer', '').strip()
-    redis.srem('alive_token', token)
+    token_store.revoke(token)
+    if identity_cache is not None:
+        identity_cache.invalidate_token(token)
     return {
         'message': 'Logout successful',
     }
+
+
+@bp.route('/logout_all')
+@login_required
+def logout_all():
+    n_tokens = token_store.revoke_all(current_user.id)
+    if identity_cache is not None:
+        identity_cache.invalidate_user(current_user.id)
+    return {
+        'message': f'Logout {n_tokens} sessions successful',
+    }
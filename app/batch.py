@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from flask.views import MethodView
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    request,
+    _app_ctx_stack,
+)
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+from . import serialization, sqltrace
+from .models import db
+
+try:
+    import gevent.monkey
+    import gevent.pool
+except ImportError:
+    gevent = None
+
+
+@contextmanager
+def own_g():
+    """A g of its own for the block, the app context and its session are shared"""
+    ctx = _app_ctx_stack.top
+    outer = ctx.g
+    ctx.g = ctx.app.app_ctx_globals_class()
+    try:
+        yield
+    finally:
+        ctx.g = outer
+
+
+def dispatch(path, user, base_url, headers):
+    """Run GET path as a request of user and return its (status, headers, body)"""
+    app = current_app._get_current_object()     #pylint:disable=W0212
+    environ = EnvironBuilder(path=path, base_url=base_url, headers=headers).get_environ()
+    with own_g(), app.request_context(environ) as ctx:
+        # where flask_login keeps the user of the request, so it is not loaded again
+        ctx.user = user
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:     #pylint:disable=W0703
+            db.session.rollback()   #pylint:disable=E1101
+            response = app.make_response(app.handle_exception(e))
+        data = response.get_data()
+
+    if not data:
+        body = None
+    elif response.is_json:
+        body = serialization.loads(data)
+    else:
+        body = data.decode()
+    validators = {
+        name: response.headers[name]
+        for name in ('ETag', 'Last-Modified')
+        if name in response.headers
+    }
+    return response.status_code, validators, body
+
+
+def dispatch_in_greenlet(app, path, user, base_url, headers):
+    # greenlets have their own contexts and sessions
+    with app.app_context():
+        if user.is_authenticated:
+            user = db.session.merge(user, load=False)     #pylint:disable=E1101
+        return dispatch(path, user, base_url, headers)
+
+
+def concurrency():
+    # without the patched sockets of the gevent worker the greenlets would run one after the other
+    if gevent is None or not gevent.monkey.is_module_patched('socket'):
+        return 1
+    return current_app.config['BATCH_CONCURRENCY']
+
+
+class BatchAPI(MethodView):
+    @staticmethod
+    def _validate(data):
+        paths = data.get('requests') if isinstance(data, dict) else None
+        if not paths or not isinstance(paths, list):
+            abort(400, 'Requests are required')
+
+        limit = current_app.config['BATCH_MAX_REQUESTS']
+        if len(paths) > limit:
+            abort(400, f'At most {limit} requests can be sent at once')
+
+        adapter = current_app.create_url_adapter(request)
+        endpoints = current_app.config['BATCH_ENDPOINTS']
+        for index, path in enumerate(paths):
+            if not isinstance(path, str) or not path.startswith('/') or path.startswith('//'):
+                abort(400, f'Request {index} is not a relative GET path')
+            try:
+                endpoint, _ = adapter.match(urlsplit(path).path, method='GET')
+            except HTTPException:
+                endpoint = None
+            if endpoint not in endpoints:
+                abort(400, f'Request {index} is not an allowed GET path')
+        return paths
+
+    def post(self):
+        paths = self._validate(request.json)
+
+        # auth once for all of the sub-requests
+        user = current_user._get_current_object()   #pylint:disable=W0212
+        base_url = request.host_url
+        headers = {
+            name: request.headers[name]
+            for name in ('Authorization', 'Accept')
+            if name in request.headers
+        }
+
+        # the sub-requests are traced and measured as requests of their own endpoints
+        with sqltrace.paused():
+            n_greenlets = min(concurrency(), len(paths))
+            if n_greenlets > 1:
+                app = current_app._get_current_object()     #pylint:disable=W0212
+                results = gevent.pool.Pool(n_greenlets).map(
+                    lambda path: dispatch_in_greenlet(app, path, user, base_url, headers),
+                    paths,
+                )
+            else:
+                results = [dispatch(path, user, base_url, headers) for path in paths]
+
+        return {
+            'responses': [
+                {
+                    'status': status,
+                    'headers': headers,
+                    'body': body,
+                }
+                for status, headers, body in results
+            ],
+        }, 200
+
+
+bp = Blueprint('batch', __name__)
+
+bp.add_url_rule('', view_func=BatchAPI.as_view('batch_view'), methods=['POST'])
@@ -0,0 +1,101 @@
+import time
+from uuid import uuid4
+
+from flask import current_app
+
+from . import auth, serialization
+from .models import (
+    Post,
+    User,
+    Like,
+    db,
+    on_save,
+)
+
+
+STATS_KEY = 'cache:stats'
+
+
+def _post_key(post_id):
+    # v4 entries are hashes of the serialized response bodies with their ETag and Last-Modified
+    # by fieldset, so that one DEL invalidates all of them
+    return f'post:v4:{post_id}'
+
+
+def _incr(counter):
+    auth.redis.hincrby(STATS_KEY, counter, 1)
+
+
+def get_post(post_id, loader, fields=()):
+    """Read-through lookup of the detail entry of a post with fields
+
+    loader is called on a miss and its result is cached unless it is None.
+    Only one worker refills a hot key, the others wait for it a little
+    before falling back to the loader.
+    """
+    key = _post_key(post_id)
+    fieldset = ','.join(fields)
+    cached = auth.redis.hget(key, fieldset)
+    if cached is not None:
+        _incr('hits')
+        return serialization.loads(cached)
+    _incr('misses')
+
+    lock_key = f'{key}:{fieldset}:lock'
+    lock_token = uuid4().hex
+    lock_timeout = int(current_app.config['POST_CACHE_LOCK_TIMEOUT'] * 1000)
+    if auth.redis.set(lock_key, lock_token, nx=True, px=lock_timeout):
+        try:
+            data = loader()
+            if data is not None:
+                pipe = auth.redis.pipeline()
+                pipe.hset(key, fieldset, serialization.dumps(data, pretty=False))
+                pipe.expire(key, current_app.config['POST_CACHE_TTL'])
+                pipe.execute()
+            return data
+        finally:
+            if auth.redis.get(lock_key) == lock_token.encode():
+                auth.redis.delete(lock_key)
+
+    deadline = time.monotonic() + current_app.config['POST_CACHE_LOCK_WAIT']
+    while time.monotonic() < deadline:
+        time.sleep(0.01)
+        cached = auth.redis.hget(key, fieldset)
+        if cached is not None:
+            return serialization.loads(cached)
+    return loader()
+
+
+def invalidate_post(post_id):
+    if auth.redis.delete(_post_key(post_id)):
+        _incr('evictions')
+
+
+def invalidate_posts(post_ids):
+    if not post_ids:
+        return
+    n_deleted = auth.redis.delete(*[_post_key(post_id) for post_id in post_ids])
+    if n_deleted:
+        auth.redis.hincrby(STATS_KEY, 'evictions', n_deleted)
+
+
+@on_save
+def invalidate_on_save(instance):
+    if isinstance(instance, Post):
+        invalidate_post(instance.id)
+    elif isinstance(instance, Like):
+        invalidate_post(instance.post_id)
+    elif isinstance(instance, User):
+        # the detail entries embed the author
+        posts = db.session.query(Post.id).filter(Post.author_id == instance.id).all()     #pylint:disable=E1101
+        post_ids = [post_id for post_id, in posts]
+        for i in range(0, len(post_ids), 1000):
+            invalidate_posts(post_ids[i:i+1000])
+
+
+def stats():
+    counters = auth.redis.hgetall(STATS_KEY)
+    return {
+        name: int(counters.get(name.encode(), 0))
+        for name in ('hits', 'misses', 'evictions')
+    }
@@ -10,22 +10,135 @@ class BaseConfig:
 
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
 
-    SQLALCHEMY_TRACK_MODIFICATIONS = True
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
 
     GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 
     GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
 
-    GOOGLE_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+    GOOGLE_DISCOVERY_URL = os.getenv('GOOGLE_DISCOVERY_URL',
+                                     'https://accounts.google.com/.well-known/openid-configuration')
+
+    # used when the discovery document can not be fetched
+    GOOGLE_AUTHORIZATION_ENDPOINT = os.getenv('GOOGLE_AUTHORIZATION_ENDPOINT',
+                                              'https://accounts.google.com/o/oauth2/v2/auth')
+
+    GOOGLE_TOKEN_ENDPOINT = os.getenv('GOOGLE_TOKEN_ENDPOINT', 'https://oauth2.googleapis.com/token')
+
+    GOOGLE_USERINFO_ENDPOINT = os.getenv('GOOGLE_USERINFO_ENDPOINT',
+                                         'https://openidconnect.googleapis.com/v1/userinfo')
+
+    OIDC_DISCOVERY_TTL = 3600
+
+    # used when the JWKS response has no max-age
+    OIDC_JWKS_TTL = 3600
+
+    # a signing key miss refreshes the JWKS at most once in this many seconds
+    OIDC_JWKS_MIN_REFRESH = 60
 
     FACEBOOK_CLIENT_ID = os.getenv('FACEBOOK_CLIENT_ID')
 
     FACEBOOK_CLIENT_SECRET = os.getenv('FACEBOOK_CLIENT_SECRET')
 
+    FACEBOOK_AUTHORIZATION_ENDPOINT = os.getenv('FACEBOOK_AUTHORIZATION_ENDPOINT',
+                                                'https://www.facebook.com/v10.0/dialog/oauth')
+
+    FACEBOOK_TOKEN_ENDPOINT = os.getenv('FACEBOOK_TOKEN_ENDPOINT',
+                                        'https://graph.facebook.com/v10.0/oauth/access_token')
+
+    FACEBOOK_USERINFO_ENDPOINT = os.getenv('FACEBOOK_USERINFO_ENDPOINT',
+                                           'https://graph.facebook.com/v10.0/me?fields=name,email')
+
+    OAUTH_CONNECT_TIMEOUT = 3.05
+
+    OAUTH_READ_TIMEOUT = 10
+
+    OAUTH_MAX_RETRIES = 2
+
+    OAUTH_RETRY_BACKOFF = 0.3
+
+    OAUTH_POOL_SIZE = 10
+
+    OAUTH_MAX_CONCURRENCY = 20
+
+    # read replicas of SQLALCHEMY_DATABASE_URI, separated by spaces
+    SQLALCHEMY_REPLICA_URIS = os.getenv('SQLALCHEMY_REPLICA_URIS', '').split()
+
+    # GET requests of these endpoints read from a replica
+    REPLICA_READ_ENDPOINTS = ('post.post_view', 'post.post_search_view', 'post.like_view')
+
+    # the requests of a user read from the primary for this many seconds after the user wrote
+    REPLICA_STICKY_SECONDS = 10
+
+    # a replica which failed is skipped for this many seconds
+    REPLICA_COOLDOWN = 30
+
+    # orjson, json or auto (orjson when it is installed)
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
     REDIS_URL = os.getenv('REDIS_URL')
 
     SECRET_KEY = os.urandom(32)
 
+    IDENTITY_CACHE_ENABLED = True
+
+    IDENTITY_CACHE_TTL = 60
+
+    IDENTITY_CACHE_SIZE = 10000
+
+    POST_CACHE_TTL = int(os.getenv('POST_CACHE_TTL', 300))
+
+    # Cache-Control of /posts and /posts/<post_id>, clients revalidate with the ETag while
+    # shared caches serve the response for a few seconds
+    POST_CACHE_CONTROL = os.getenv('POST_CACHE_CONTROL', 'public, max-age=0, s-maxage=10')
+
+    # how long a worker may hold the refill lock of a hot key, in seconds
+    POST_CACHE_LOCK_TIMEOUT = 5
+
+    # how long other workers wait for the refill before loading by themselves, in seconds
+    POST_CACHE_LOCK_WAIT = 0.5
+
+    # posts accepted by one POST /posts/batch
+    POST_BATCH_LIMIT = 100
+
+    # GET sub-requests accepted by one POST /batch
+    BATCH_MAX_REQUESTS = 20
+
+    # endpoints the sub-requests of POST /batch can reach, reads without side effects only
+    BATCH_ENDPOINTS = ('post.post_view', 'post.post_search_view', 'post.like_view')
+
+    # sub-requests of one POST /batch run at once in greenlets, under the gevent worker only
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+    # posts kept in the Redis feed index, globally and per author
+    FEED_MAX_LENGTH = 100000
+
+    # seconds between two flushes of the like counters to posts.n_likes
+    LIKES_FLUSH_INTERVAL = 5
+
+    LIKES_FLUSH_BATCH_SIZE = 500
+
+    # how long the time of the last like or unlike of a post is kept for its validators, in seconds
+    LIKES_TOUCHED_TTL = 86400
+
+    # SQL statements allowed per request by endpoint, SQL_BUDGET_DEFAULT for the others
+    SQL_BUDGETS = {
+        'post.post_view': 4,
+        'post.like_view': 5,
+        'auth.oauth_callback': 4,
+    }
+
+    SQL_BUDGET_DEFAULT = 10
+
+    # the same statement run this many times in one request is reported as an N+1
+    SQL_REPEAT_THRESHOLD = 3
+
+    # raise instead of logging when a request is over its budget
+    SQL_BUDGET_RAISE = False
+
+    # X-SQL-Count response header
+    SQL_COUNT_HEADER = True
+
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
@@ -40,6 +153,21 @@ class TestingConfig(BaseConfig):
 
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
 
+    SQLALCHEMY_REPLICA_URIS = []
+
+    LIKES_FLUSH_INTERVAL = 0
+
+    SQL_BUDGET_RAISE = True
+
+
+class BenchmarkConfig(TestingConfig):
+    SQL_BUDGET_RAISE = False
+
+    SQLALCHEMY_DATABASE_URI = os.getenv(
+        'BENCHMARK_DATABASE_URI',
+        'sqlite:///' + os.path.join(BaseConfig.ROOTDIR, 'benchmark.sqlite3'),
+    )
+
 
 class ProductionConfig(BaseConfig):
     ...
@@ -49,5 +177,6 @@ def get_config(config_name):
     return {
         'development': DevelopmentConfig,
         'testing': TestingConfig,
+        'benchmark': BenchmarkConfig,
         'production': ProductionConfig,
     }.get(config_name)
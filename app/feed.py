@@ -0,0 +1,164 @@
+import logging
+from datetime import timezone
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from redis.exceptions import RedisError
+
+from . import auth
+from .models import (
+    Post,
+    db,
+    on_save,
+)
+
+
+logger = logging.getLogger(__name__)
+
+FEED_KEY = 'feed:posts'
+
+# set by a complete rebuild, the index is cold without it
+READY_KEY = 'feed:ready'
+
+MEMBER_WIDTH = 12
+
+
+def _author_key(author_id):
+    return f'feed:author:{author_id}'
+
+
+def _member(post_id):
+    # zero padded, so that posts with the same score are ordered by id like in SQL
+    return str(post_id).zfill(MEMBER_WIDTH)
+
+
+def _score(created_at):
+    return created_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _add(pipe, posts, max_length):
+    keys = set()
+    for post_id, author_id, created_at in posts:
+        member = {_member(post_id): _score(created_at)}
+        pipe.zadd(FEED_KEY, member)
+        pipe.zadd(_author_key(author_id), member)
+        keys.add(_author_key(author_id))
+
+    # only the newest max_length posts are kept, older pages are read from SQL
+    for key in keys | {FEED_KEY}:
+        pipe.zremrangebyrank(key, 0, -max_length - 1)
+
+
+def add_posts(posts):
+    """Index (id, author_id, created_at) of new posts"""
+    if not posts:
+        return
+    try:
+        pipe = auth.redis.pipeline(transaction=False)
+        _add(pipe, posts, current_app.config['FEED_MAX_LENGTH'])
+        pipe.execute()
+    except RedisError:
+        logger.exception('Can not index posts, the feed index is marked cold')
+        try:
+            auth.redis.delete(READY_KEY)
+        except RedisError:
+            logger.exception('Can not mark the feed index cold')
+
+
+@on_save
+def index_on_save(instance):
+    if isinstance(instance, Post):
+        add_posts([(instance.id, instance.author_id, instance.created_at)])
+
+
+def get_post_ids(limit, author_id=None, after=None, offset=0):
+    """Ids of a page of posts, newest first, or None when the index can not answer
+
+    after is the (created_at, id) of the last post of the previous page.
+    """
+    if limit < 1:
+        return None
+
+    key = FEED_KEY if author_id is None else _author_key(author_id)
+    max_score = '+inf' if after is None else _score(after[0])
+    try:
+        pipe = auth.redis.pipeline(transaction=False)
+        pipe.exists(READY_KEY)
+        pipe.zcard(key)
+        pipe.zrevrangebyscore(key, max_score, '-inf', start=offset, num=limit, withscores=True)
+        ready, length, batch = pipe.execute()
+        if not ready:
+            return None
+
+        ids = []
+        start = offset
+        while True:
+            for member, score in batch:
+                post_id = int(member)
+                # posts created in the same second as the last one were on the previous page
+                if after is not None and score == max_score and post_id >= after[1]:
+                    continue
+                ids.append(post_id)
+            if len(ids) >= limit or len(batch) < limit:
+                break
+            start += limit
+            batch = auth.redis.zrevrangebyscore(key, max_score, '-inf', start=start, num=limit, withscores=True)
+    except RedisError:
+        logger.exception('Can not read the feed index')
+        return None
+
+    # the end of a trimmed index is not the end of the posts
+    if len(ids) < limit and length >= current_app.config['FEED_MAX_LENGTH']:
+        return None
+    return ids[:limit]
+
+
+def rebuild(batch_size=1000):
+    """Index all posts again, the index is cold meanwhile"""
+    auth.redis.delete(READY_KEY)
+    keys = [FEED_KEY, *auth.redis.scan_iter(match=_author_key('*'), count=1000)]
+    for i in range(0, len(keys), 1000):
+        auth.redis.delete(*keys[i:i+1000])
+
+    # posts created meanwhile are indexed by index_on_save as well, ZADD is idempotent
+    query = db.session.query(       #pylint:disable=E1101
+        Post.id,
+        Post.author_id,
+        Post.created_at,
+    ).order_by(Post.id).yield_per(batch_size)
+
+    max_length = current_app.config['FEED_MAX_LENGTH']
+    n_posts = 0
+    batch = []
+    for row in query:
+        batch.append(row)
+        if len(batch) == batch_size:
+            pipe = auth.redis.pipeline(transaction=False)
+            _add(pipe, batch, max_length)
+            pipe.execute()
+            n_posts += len(batch)
+            batch = []
+    if batch:
+        pipe = auth.redis.pipeline(transaction=False)
+        _add(pipe, batch, max_length)
+        pipe.execute()
+        n_posts += len(batch)
+
+    auth.redis.set(READY_KEY, 1)
+    return n_posts
+
+
+cli = AppGroup('feed', help='Manage the feed index.')
+
+
+@cli.command('rebuild')
+@click.option('--batch-size', default=1000, show_default=True)
+def rebuild_command(batch_size):
+    """Index all posts in the Redis feed index."""
+    n_posts = rebuild(batch_size)
+    click.echo(f'Indexed {n_posts} posts')
+
+
+def init_app(app):
+    app.cli.add_command(cli)
@@ -0,0 +1,128 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from redis.exceptions import RedisError
+from sqlalchemy.orm import make_transient_to_detached
+
+from .models import User
+from .tokens import digest
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'identity:invalidate'
+
+USER_COLUMNS = ('id', 'name', 'email', 'link_to_facebook', 'link_to_google', 'occupation')
+
+
+class IdentityCache:
+    """Bounded per-worker cache from an access token to the user it belongs to
+
+    Entries are kept and invalidated by the digest of the token, not the
+    token itself. Entries expire after ttl seconds, or with their token when
+    it expires sooner. Invalidations are broadcast through
+    Redis pub/sub so revoking a token or changing a user drops the entry in
+    every worker, each worker listens from its own background thread.
+    """
+
+    def __init__(self, redis, maxsize, ttl, listen=True):
+        self.redis = redis
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.listen = listen
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def get(self, token):
+        self._ensure_listener()
+        key = digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, token, user, ttl=None):
+        # keep a detached copy of the columns only, it is merged into the
+        # session of the request that hits it
+        record = User(**{column: getattr(user, column) for column in USER_COLUMNS})
+        make_transient_to_detached(record)
+
+        key = digest(token)
+        with self._lock:
+            ttl = self.ttl if ttl is None else min(self.ttl, ttl)
+            self._entries[key] = (time.monotonic() + ttl, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_token(self, token):
+        key = digest(token)
+        self._discard(key)
+        self._publish(f'digest:{key}')
+
+    def invalidate_user(self, user_id):
+        self._discard_user(user_id)
+        self._publish(f'user:{user_id}')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _discard_user(self, user_id):
+        with self._lock:
+            for key, (_, user) in list(self._entries.items()):
+                if user.id == user_id:
+                    del self._entries[key]
+
+    def _publish(self, message):
+        try:
+            self.redis.publish(CHANNEL, message)
+        except RedisError:
+            logger.exception('Can not broadcast identity invalidation %s', message)
+
+    def _handle(self, message):
+        kind, _, value = message.decode().partition(':')
+        if kind == 'digest':
+            self._discard(value)
+        elif kind == 'token':
+            # sent by the workers which predate the digests
+            self._discard(digest(value))
+        elif kind == 'user':
+            self._discard_user(int(value))
+
+    def _ensure_listener(self):
+        # started lazily so that every forked worker gets its own listener
+        if not self.listen or self._listener_pid == os.getpid():
+            return
+        self._listener_pid = os.getpid()
+        self.clear()
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    self._handle(message['data'])
+            except RedisError:
+                logger.exception('Identity invalidation listener was disconnected')
+                # messages may have been missed while disconnected
+                self.clear()
+                time.sleep(1)
@@ -0,0 +1,270 @@
+import os
+import time
+import logging
+import threading
+from uuid import uuid4
+from datetime import datetime, timedelta
+
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import AppGroup
+from redis.exceptions import RedisError
+
+from . import auth
+from .models import (
+    Post,
+    User,
+    Like,
+    LikeFlush,
+    db,
+    on_save,
+)
+
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'likes:pending'
+
+FLUSHING_KEY = 'likes:flushing'
+
+# id of the flush of the deltas in FLUSHING_KEY, recorded in like_flushes with the UPDATEs
+FLUSH_ID_KEY = 'likes:flushing:id'
+
+FLUSH_LOCK_KEY = 'likes:flush:lock'
+
+# applied flushes are kept in like_flushes for a retry of a flush which died after its commit
+FLUSH_ID_RETENTION = timedelta(days=1)
+
+flusher = None
+
+
+def _touched_key(post_id):
+    # time of the last like or unlike of the post, part of the ETag and Last-Modified of the posts,
+    # expiring after LIKES_TOUCHED_TTL so that the keys of the old posts go away
+    return f'likes:touched:{post_id}'
+
+
+def add_delta(post_id, delta):
+    pipe = auth.redis.pipeline()
+    pipe.hincrby(PENDING_KEY, post_id, delta)
+    pipe.set(_touched_key(post_id), time.time(), ex=current_app.config['LIKES_TOUCHED_TTL'])
+    pipe.execute()
+    if flusher is not None:
+        flusher.ensure_started()
+
+
+def _is_applied(flush_id):
+    return db.session.query(LikeFlush.id).filter(LikeFlush.id == flush_id).scalar() is not None     #pylint:disable=E1101
+
+
+def get_like_state(posts):
+    """(n_likes, time of the last like or unlike or None) of the posts
+
+    n_likes is the persisted count plus the deltas which are not flushed yet.
+    """
+    post_ids = [post.id for post in posts]
+    if not post_ids:
+        return {}
+
+    pipe = auth.redis.pipeline()
+    pipe.hmget(PENDING_KEY, post_ids)
+    pipe.hmget(FLUSHING_KEY, post_ids)
+    pipe.get(FLUSH_ID_KEY)
+    pipe.mget([_touched_key(post_id) for post_id in post_ids])
+    pending, flushing, flush_id, touched = pipe.execute()
+
+    # once its flush is committed the deltas are in n_likes, until FLUSHING_KEY is deleted
+    # or for good when the flush died in between
+    if flush_id is not None and _is_applied(flush_id.decode()):
+        flushing = [None] * len(post_ids)
+
+    return {
+        post.id: (
+            post.n_likes + int(pending[i] or 0) + int(flushing[i] or 0),
+            float(touched[i]) if touched[i] else None,
+        )
+        for i, post in enumerate(posts)
+    }
+
+
+def get_like_counts(posts):
+    """Persisted n_likes of the posts plus the deltas which are not flushed yet"""
+    return {post_id: n_likes for post_id, (n_likes, _) in get_like_state(posts).items()}
+
+
+def flush(batch_size=500, lock_timeout=60):
+    """Apply the pending deltas to posts.n_likes in batched UPDATEs
+
+    Returns the number of updated posts, or None when another flush is running.
+    """
+    lock_token = uuid4().hex
+    if not auth.redis.set(FLUSH_LOCK_KEY, lock_token, nx=True, ex=lock_timeout):
+        return None
+
+    try:
+        # a flush which died before finishing left its deltas in FLUSHING_KEY,
+        # they are applied before taking the new ones
+        if not auth.redis.exists(FLUSHING_KEY):
+            if not auth.redis.exists(PENDING_KEY):
+                return 0
+            pipe = auth.redis.pipeline()
+            pipe.rename(PENDING_KEY, FLUSHING_KEY)
+            pipe.set(FLUSH_ID_KEY, uuid4().hex)
+            pipe.execute()
+
+        flush_id = auth.redis.get(FLUSH_ID_KEY)
+        if flush_id is None:
+            # left by a flush without ids, it did not commit either
+            flush_id = uuid4().hex
+            auth.redis.set(FLUSH_ID_KEY, flush_id)
+        else:
+            flush_id = flush_id.decode()
+
+        deltas = [
+            {'post_id': int(post_id), 'delta': int(delta)}
+            for post_id, delta in auth.redis.hgetall(FLUSHING_KEY).items()
+            if int(delta)
+        ]
+
+        # the flush id is committed with the UPDATEs, a flush which died after
+        # its commit is not applied again
+        if not _is_applied(flush_id):
+            statement = Post.__table__.update().where(
+                Post.id == sa.bindparam('post_id'),
+            ).values(
+                n_likes=Post.n_likes + sa.bindparam('delta'),
+                # a like is not an edit of the post
+                updated_at=Post.updated_at,
+            )
+            for i in range(0, len(deltas), batch_size):
+                db.session.execute(statement, deltas[i:i+batch_size])     #pylint:disable=E1101
+            db.session.add(LikeFlush(id=flush_id))     #pylint:disable=E1101
+            LikeFlush.query.filter(
+                LikeFlush.created_at < datetime.utcnow() - FLUSH_ID_RETENTION,
+            ).delete(synchronize_session=False)
+            db.session.commit()     #pylint:disable=E1101
+
+        auth.redis.delete(FLUSHING_KEY, FLUSH_ID_KEY)
+
+        # readers which loaded the posts before the commit and checked the flush
+        # after it missed the deltas, the detail entries filled meanwhile are dropped
+        from . import cache     # imported here, cache registers its on_save hook after this module
+        cache.invalidate_posts([delta['post_id'] for delta in deltas])
+        return len(deltas)
+    finally:
+        if auth.redis.get(FLUSH_LOCK_KEY) == lock_token.encode():
+            auth.redis.delete(FLUSH_LOCK_KEY)
+
+
+def _liker(column, offset):
+    return sa.select(column).select_from(
+        Like.__table__.join(User.__table__, User.id == Like.user_id),
+    ).where(
+        Like.post_id == Post.id,
+    ).order_by(Like.id).limit(1).offset(offset).scalar_subquery()
+
+
+def _summary_update(*criteria):
+    return Post.__table__.update().where(
+        *criteria,
+    ).values(
+        first_liker_id=_liker(Like.user_id, 0),
+        first_liker_name=_liker(User.name, 0),
+        second_liker_id=_liker(Like.user_id, 1),
+        second_liker_name=_liker(User.name, 1),
+        # a like is not an edit of the post
+        updated_at=Post.updated_at,
+    )
+
+
+def update_summary(*criteria):
+    """Set the first two likers of the posts matching criteria from the likes table
+
+    Runs in the transaction of the session, so that the summary changes with the like.
+    """
+    return db.session.execute(_summary_update(*criteria)).rowcount     #pylint:disable=E1101
+
+
+@on_save
+def summarize_on_save(instance):
+    # registered before the cache invalidation, this module is imported before the cache
+    if isinstance(instance, Like):
+        # a new like is the newest one, it only changes posts with less than two likers,
+        # run outside of the session so that the saved instances are not expired again
+        with db.engine.begin() as conn:
+            conn.execute(_summary_update(Post.id == instance.post_id, Post.second_liker_id.is_(None)))
+
+
+def on_unlike(post_id, user_id):
+    update_summary(
+        Post.id == post_id,
+        sa.or_(Post.first_liker_id == user_id, Post.second_liker_id == user_id),
+    )
+
+
+def rebuild_summary(batch_size=1000):
+    """Set the first two likers of all posts, in batches of post ids"""
+    max_id = db.session.query(sa.func.max(Post.id)).scalar() or 0     #pylint:disable=E1101
+    n_posts = 0
+    for start in range(0, max_id, batch_size):
+        n_posts += update_summary(Post.id > start, Post.id <= start + batch_size)
+        db.session.commit()     #pylint:disable=E1101
+    return n_posts
+
+
+class LikeFlusher:
+    """Background thread flushing the like counters every interval seconds
+
+    Started lazily by the first like of every worker process.
+    """
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    flush(self.app.config['LIKES_FLUSH_BATCH_SIZE'])
+                except (RedisError, sa.exc.SQLAlchemyError):
+                    logger.exception('Can not flush like counters')
+                    db.session.rollback()     #pylint:disable=E1101
+
+
+cli = AppGroup('likes', help='Manage like counters.')
+
+
+@cli.command('flush')
+def flush_command():
+    """Write the pending like counters to posts.n_likes."""
+    n_posts = flush(current_app.config['LIKES_FLUSH_BATCH_SIZE'])
+    if n_posts is None:
+        click.echo('Another flush is running')
+    else:
+        click.echo(f'Flushed like counters of {n_posts} posts')
+
+
+@cli.command('rebuild-summary')
+@click.option('--batch-size', default=1000, show_default=True)
+def rebuild_summary_command(batch_size):
+    """Set the first two likers of all posts from the likes table."""
+    n_posts = rebuild_summary(batch_size)
+    click.echo(f'Updated the likers of {n_posts} posts')
+
+
+def init_app(app):
+    global flusher
+    flusher = None
+    if app.config['LIKES_FLUSH_INTERVAL']:
+        flusher = LikeFlusher(app, app.config['LIKES_FLUSH_INTERVAL'])
+    app.cli.add_command(cli)
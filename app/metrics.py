@@ -0,0 +1,162 @@
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from . import auth
+from .oauth2 import OAuth2Client
+
+
+# the metrics are process globals, with PROMETHEUS_MULTIPROC_DIR set every
+# worker writes them to its own mmaped files which /metrics aggregates
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Request latency',
+    ['blueprint', 'endpoint', 'method', 'status'],
+)
+
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'Requests being handled',
+    ['blueprint', 'endpoint'],
+    multiprocess_mode='livesum',
+)
+
+SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements',
+    'SQL statements executed per request',
+    ['blueprint', 'endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+
+SQL_DURATION = Histogram(
+    'http_request_sql_duration_seconds',
+    'Time spent executing SQL per request',
+    ['blueprint', 'endpoint'],
+)
+
+REDIS_LATENCY = Histogram(
+    'redis_command_duration_seconds',
+    'Redis command latency',
+    ['command'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+
+OAUTH_LATENCY = Histogram(
+    'oauth_request_duration_seconds',
+    'Latency of the calls to the OAuth providers',
+    ['provider', 'method', 'status'],
+)
+
+OAUTH_ERRORS = Counter(
+    'oauth_request_errors',
+    'Calls to the OAuth providers which got no response',
+    ['provider', 'method'],
+)
+
+
+def _labels():
+    return request.blueprint or '', request.endpoint or 'none'
+
+
+def before_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_labels = _labels()
+    REQUESTS_IN_FLIGHT.labels(*g.metrics_labels).inc()
+
+
+def _observe(status):
+    labels = g.pop('metrics_labels', None)
+    if labels is None:
+        return
+
+    REQUESTS_IN_FLIGHT.labels(*labels).dec()
+    REQUEST_LATENCY.labels(
+        *labels, request.method, status,
+    ).observe(time.perf_counter() - g.pop('metrics_started'))
+
+    # recorded by sqltrace, whose hooks run around these ones
+    trace = g.get('sql_trace')
+    if trace is not None:
+        SQL_STATEMENTS.labels(*labels).observe(trace.count)
+        SQL_DURATION.labels(*labels).observe(trace.duration)
+
+
+def after_request(response):
+    _observe(response.status_code)
+    return response
+
+
+def teardown_request(exc):
+    # after_request is skipped when the exception propagates
+    _observe(500)
+
+
+def instrument_redis(client):
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def timed_execute_command(*args, **options):
+        started = time.perf_counter()
+        try:
+            return execute_command(*args, **options)
+        finally:
+            REDIS_LATENCY.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                REDIS_LATENCY.labels('PIPELINE').observe(time.perf_counter() - started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+    return client
+
+
+def observe_oauth_request(provider, method, response, duration):
+    if response is None:
+        OAUTH_ERRORS.labels(provider, method).inc()
+    else:
+        OAUTH_LATENCY.labels(provider, method, response.status_code).observe(duration)
+
+
+def get_registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics():
+    return Response(generate_latest(get_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+    instrument_redis(auth.redis)
+    if observe_oauth_request not in OAuth2Client.request_hooks:
+        OAuth2Client.request_hooks.append(observe_oauth_request)
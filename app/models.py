@@ -1,20 +1,71 @@
+from contextlib import contextmanager
+
 import sqlalchemy as sa
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.dialects import sqlite
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
 from flask_migrate import Migrate
 from flask_login import UserMixin
 
 
-db = SQLAlchemy()
+class RoutingSession(SignallingSession):
+    """Reads from the replica bind in g.db_replica when it is set, see app/replicas.py
+
+    Flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+@contextmanager
+def use_primary():
+    """Run the queries of the block on the primary in a request routed to a replica"""
+    replica = g.pop('db_replica', None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.db_replica = replica
+
+# MySQL TIMESTAMP keeps whole seconds, store SQLite values the same way so that
+# bound datetimes compare equal to the CURRENT_TIMESTAMP defaults
+Timestamp = sa.TIMESTAMP().with_variant(sqlite.DATETIME(
+    storage_format='%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d',
+    regexp=r'(\d+)-(\d+)-(\d+) (\d+):(\d+):(\d+)',
+), 'sqlite')
+
+_save_listeners = []
+
+
+def on_save(func):
+    """Register func to be called with every instance committed by BaseModel.save"""
+    _save_listeners.append(func)
+    return func
 
 
 class BaseModel:
     id = sa.Column(sa.Integer(), primary_key=True, autoincrement=True)
-    created_at = sa.Column(sa.TIMESTAMP(), default=sa.func.now())
-    updated_at = sa.Column(sa.TIMESTAMP(), onupdate=sa.func.now())
+    created_at = sa.Column(Timestamp, default=sa.func.now())
+    updated_at = sa.Column(Timestamp, onupdate=sa.func.now())
 
     def save(self):
         db.session.add(self)    #pylint:disable=E1101
         db.session.commit()     #pylint:disable=E1101
+        for listener in _save_listeners:
+            listener(self)
         return self
 
     def to_dict(self):
@@ -43,27 +94,46 @@ class User(BaseModel, UserMixin, db.Model):
 
 class Post(BaseModel, db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        sa.Index('ix_posts_author_id_created_at_id', 'author_id', 'created_at', 'id'),
+        sa.Index('ix_posts_created_at_id', 'created_at', 'id'),
+    )
 
+    # the posts lists page on it and the validators fall back to it
+    created_at = sa.Column(Timestamp, default=sa.func.now(), nullable=False)
     title = sa.Column(sa.String(100), nullable=False)
     summary = sa.Column(sa.String(200), nullable=False)
-    body = sa.Column(sa.String(1500), nullable=False)
+    # only the detail shows it
+    body = sa.orm.deferred(sa.Column(sa.String(1500), nullable=False))
     author_id = sa.Column(sa.Integer(), sa.ForeignKey('users.id'), nullable=False)
     author = sa.orm.relationship(User, backref='posts')
     n_likes = sa.Column(sa.Integer(), default=0, nullable=False)
+    # the first two likers, for the like string without reading likes
+    first_liker_id = sa.Column(sa.Integer())
+    first_liker_name = sa.Column(sa.String(50))
+    second_liker_id = sa.Column(sa.Integer())
+    second_liker_name = sa.Column(sa.String(50))
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'body': self.body,
-            'author': self.author.to_dict(),
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-        }
+    @property
+    def author_name(self):
+        return self.author.name
+
+    FIELDS = ('id', 'title', 'body', 'author', 'created_at', 'updated_at')
+
+    def to_dict(self, fields=FIELDS):
+        data = {}
+        for field in fields:
+            value = getattr(self, field)
+            data[field] = value.to_dict() if field == 'author' else value
+        return data
 
 
 class Like(BaseModel, db.Model):
     __tablename__ = 'likes'
+    __table_args__ = (
+        sa.Index('ix_likes_post_id_id', 'post_id', 'id'),
+        sa.Index('uq_likes_user_id_post_id', 'user_id', 'post_id', unique=True),
+    )
 
     user_id = sa.Column(sa.Integer(), sa.ForeignKey('users.id'), nullable=False)
     user = sa.orm.relationship(User, backref='likes')
@@ -71,6 +141,62 @@ class Like(BaseModel, db.Model):
     post = sa.orm.relationship(Post, backref='likes')
 
 
+class LikeFlush(db.Model):
+    """A flush of the like counters applied to posts.n_likes, so that a retried flush is not applied again"""
+    __tablename__ = 'like_flushes'
+
+    id = sa.Column(sa.String(32), primary_key=True)
+    created_at = sa.Column(Timestamp, default=sa.func.now(), nullable=False)
+
+
+# full-text index of title, summary and body for /posts/search: an FTS5 table kept in sync by
+# triggers on SQLite, a FULLTEXT index on MySQL
+POST_SEARCH_TABLE = 'posts_fts'
+
+POST_SEARCH_DDL = {
+    'sqlite': (
+        "CREATE VIRTUAL TABLE posts_fts USING fts5("
+        "title, summary, body, content='posts', content_rowid='id')",
+        "CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN "
+        "INSERT INTO posts_fts(rowid, title, summary, body) "
+        "VALUES (new.id, new.title, new.summary, new.body); END",
+        "CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN "
+        "INSERT INTO posts_fts(posts_fts, rowid, title, summary, body) "
+        "VALUES ('delete', old.id, old.title, old.summary, old.body); END",
+        "CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, summary, body ON posts BEGIN "
+        "INSERT INTO posts_fts(posts_fts, rowid, title, summary, body) "
+        "VALUES ('delete', old.id, old.title, old.summary, old.body); "
+        "INSERT INTO posts_fts(rowid, title, summary, body) "
+        "VALUES (new.id, new.title, new.summary, new.body); END",
+    ),
+    'mysql': (
+        'ALTER TABLE posts ADD FULLTEXT INDEX ft_posts_title_summary_body (title, summary, body)',
+    ),
+}
+
+for _dialect, _statements in POST_SEARCH_DDL.items():
+    for _statement in _statements:
+        sa.event.listen(Post.__table__, 'after_create', sa.DDL(_statement).execute_if(dialect=_dialect))
+sa.event.listen(
+    Post.__table__,
+    'before_drop',
+    sa.DDL(f'DROP TABLE IF EXISTS {POST_SEARCH_TABLE}').execute_if(dialect='sqlite'),
+)
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # the FTS5 table and its shadow tables are managed by POST_SEARCH_DDL
+    return not (type_ == 'table' and name.startswith(POST_SEARCH_TABLE))
+
+
 def init_app(app):
+    # every replica is a bind without tables, only RoutingSession uses them
+    replica_uris = app.config['SQLALCHEMY_REPLICA_URIS']
+    if replica_uris:
+        app.config['SQLALCHEMY_BINDS'] = {
+            **(app.config.get('SQLALCHEMY_BINDS') or {}),
+            **{f'replica_{i}': uri for i, uri in enumerate(replica_uris)},
+        }
+
     db.init_app(app)
-    Migrate(app, db)
+    Migrate(app, db, include_object=include_object)
@@ -1,8 +1,23 @@
+import os
+import re
 import json
+import time
+import threading
 from urllib.parse import urlparse
 
+import jwt
 import requests
-from oauthlib.oauth2 import WebApplicationClient
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from oauthlib.oauth2 import WebApplicationClient, OAuth2Error
+
+
+class ProviderError(Exception):
+    pass
+
+
+class KeysUnavailable(ProviderError):
+    pass
 
 
 class OAuth2Client:
@@ -14,11 +29,96 @@ class OAuth2Client:
 
     authorization_endpoint = None
 
+    # connect and read timeouts in seconds
+    timeout = (3.05, 10)
+
+    # retries apply to idempotent calls only, the authorization code can be used once
+    max_retries = 2
+
+    retry_backoff = 0.3
+
+    pool_size = 10
+
+    # concurrent calls to the provider per worker
+    max_concurrency = 20
+
+    _pools = {}
+
+    # called with (provider, method, response, seconds) after every call,
+    # response is None when the call failed
+    request_hooks = []
+
+    @classmethod
+    def configure(cls, config):
+        cls.timeout = (config['OAUTH_CONNECT_TIMEOUT'], config['OAUTH_READ_TIMEOUT'])
+        cls.max_retries = config['OAUTH_MAX_RETRIES']
+        cls.retry_backoff = config['OAUTH_RETRY_BACKOFF']
+        cls.pool_size = config['OAUTH_POOL_SIZE']
+        cls.max_concurrency = config['OAUTH_MAX_CONCURRENCY']
+        cls._pools.clear()
+
+        if cls.provider:
+            for name in ('authorization_endpoint', 'token_endpoint', 'userinfo_endpoint'):
+                endpoint = config.get(f'{cls.provider.upper()}_{name.upper()}')
+                if endpoint:
+                    setattr(cls, name, endpoint)
+
+    @classmethod
+    def _get_pool(cls):
+        # one keep-alive session per provider and worker process
+        pool = cls._pools.get(cls)
+        if pool is None or pool[0] != os.getpid():
+            retries = Retry(
+                total=cls.max_retries,
+                backoff_factor=cls.retry_backoff,
+                status_forcelist=(500, 502, 503, 504),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=cls.pool_size,
+                max_retries=retries,
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+            pool = (os.getpid(), session, threading.BoundedSemaphore(cls.max_concurrency))
+            cls._pools[cls] = pool
+        return pool
+
+    @classmethod
+    def request(cls, method, url, **kwargs):
+        _, session, semaphore = cls._get_pool()
+        if not semaphore.acquire(timeout=cls.timeout[0]):
+            raise ProviderError(f'Too many concurrent requests to {cls.provider}')
+        response = None
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=cls.timeout, **kwargs)
+            return response
+        except requests.RequestException as e:
+            raise ProviderError(f'Request to {cls.provider} failed: {e}') from e
+        finally:
+            semaphore.release()
+            for hook in cls.request_hooks:
+                hook(cls.provider, method, response, time.perf_counter() - started)
+
+    @classmethod
+    def check_response(cls, response):
+        if not response.ok:
+            raise ProviderError(f'{cls.provider} answered {response.status_code} to {response.url}')
+        return response
+
+    @classmethod
+    def get_endpoint(cls, name):
+        return getattr(cls, name)
+
     @classmethod
     def get_grant_request_url(cls, client_id, redirect_uri, scope=None, state=None):
         oauth_client = WebApplicationClient(client_id)
         request_uri = oauth_client.prepare_request_uri(
-            cls.authorization_endpoint,
+            cls.get_endpoint('authorization_endpoint'),
             redirect_uri=redirect_uri,
             scope=scope,
             state=json.dumps(state) if state else None,
@@ -27,43 +127,174 @@ class OAuth2Client:
         return request_uri
 
     @classmethod
-    def get_userinfo(cls, client_id, client_secret, code, authorization_response):
-        client = WebApplicationClient(client_id)
-
+    def fetch_token(cls, client, client_secret, code, authorization_response):
         base_url = authorization_response.replace('?'+urlparse(authorization_response).query, '')
 
-        # get access token
         token_url, headers, body = client.prepare_token_request(
-            cls.token_endpoint,
+            cls.get_endpoint('token_endpoint'),
             authorization_response=authorization_response,
             redirect_url=base_url,
             code=code,
         )
-        token_response = requests.post(
+        token_response = cls.request(
+            'POST',
             token_url,
             headers=headers,
             data=body,
-            auth=(client_id, client_secret),
+            auth=(client.client_id, client_secret),
         )
-        client.parse_request_body_response(token_response.text)
+        cls.check_response(token_response)
+        try:
+            return client.parse_request_body_response(token_response.text)
+        except OAuth2Error as e:
+            raise ProviderError(f'Token request to {cls.provider} failed: {e}') from e
 
-        # get user information
-        uri, headers, body = client.add_token(cls.userinfo_endpoint)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
-        data = userinfo_response.json()
+    @classmethod
+    def request_userinfo(cls, client):
+        uri, headers, body = client.add_token(cls.get_endpoint('userinfo_endpoint'))
+        userinfo_response = cls.check_response(cls.request('GET', uri, headers=headers, data=body))
+        try:
+            return userinfo_response.json()
+        except ValueError as e:
+            raise ProviderError(f'Invalid {cls.provider} userinfo: {e}') from e
 
-        return data
+    @classmethod
+    def get_userinfo(cls, client_id, client_secret, code, authorization_response):
+        client = WebApplicationClient(client_id)
+        cls.fetch_token(client, client_secret, code, authorization_response)
+        return cls.request_userinfo(client)
 
 
 class GoogleOAuth2Client(OAuth2Client):
     provider = 'google'
 
+    discovery_url = 'https://accounts.google.com/.well-known/openid-configuration'
+
+    # used when the discovery document can not be fetched
+    issuer = 'https://accounts.google.com'
+
     token_endpoint = 'https://oauth2.googleapis.com/token'
 
     userinfo_endpoint = 'https://openidconnect.googleapis.com/v1/userinfo'
 
     authorization_endpoint = 'https://accounts.google.com/o/oauth2/v2/auth'
 
+    jwks_uri = 'https://www.googleapis.com/oauth2/v3/certs'
+
+    discovery_ttl = 3600
+
+    # used when the JWKS response has no max-age
+    jwks_ttl = 3600
+
+    # a kid miss refreshes the JWKS at most once in this many seconds
+    jwks_min_refresh = 60
+
+    _discovery = (0, {})
+
+    _jwks = (0, {})
+
+    _jwks_fetched_at = 0
+
+    @classmethod
+    def configure(cls, config):
+        super().configure(config)
+        cls.discovery_url = config['GOOGLE_DISCOVERY_URL']
+        cls.discovery_ttl = config['OIDC_DISCOVERY_TTL']
+        cls.jwks_ttl = config['OIDC_JWKS_TTL']
+        cls.jwks_min_refresh = config['OIDC_JWKS_MIN_REFRESH']
+        cls._discovery = (0, {})
+        cls._jwks = (0, {})
+        cls._jwks_fetched_at = 0
+
+    @classmethod
+    def get_discovery_document(cls):
+        expires_at, document = cls._discovery
+        if expires_at < time.monotonic():
+            try:
+                document = cls.check_response(cls.request('GET', cls.discovery_url)).json()
+                ttl = cls.discovery_ttl
+            except (ProviderError, ValueError):
+                # keep the last document, or the hardcoded endpoints, and retry soon
+                ttl = min(cls.discovery_ttl, cls.jwks_min_refresh)
+            cls._discovery = (time.monotonic() + ttl, document)
+        return document
+
+    @classmethod
+    def get_endpoint(cls, name):
+        return cls.get_discovery_document().get(name) or getattr(cls, name)
+
+    @classmethod
+    def _fetch_jwks(cls):
+        from jwt.algorithms import RSAAlgorithm
+
+        cls._jwks_fetched_at = time.monotonic()
+        response = cls.request('GET', cls.get_endpoint('jwks_uri'))
+        keys = {
+            jwk['kid']: RSAAlgorithm.from_jwk(json.dumps(jwk))
+            for jwk in response.json()['keys']
+            if jwk.get('kty') == 'RSA'
+        }
+
+        ttl = cls.jwks_ttl
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        if match:
+            ttl = int(match.group(1))
+        cls._jwks = (time.monotonic() + ttl, keys)
+
+    @classmethod
+    def get_signing_key(cls, kid):
+        expires_at, keys = cls._jwks
+        stale = expires_at < time.monotonic()
+        kid_miss = kid not in keys and cls._jwks_fetched_at + cls.jwks_min_refresh < time.monotonic()
+        if stale or kid_miss:
+            try:
+                cls._fetch_jwks()
+            except (ProviderError, ValueError, KeyError) as e:
+                # keep the keys we have and retry later
+                cls._jwks = (time.monotonic() + cls.jwks_min_refresh, keys)
+                if not keys:
+                    raise KeysUnavailable(f'Can not fetch the {cls.provider} JWKS') from e
+            _, keys = cls._jwks
+        return keys.get(kid)
+
+    @classmethod
+    def verify_id_token(cls, id_token, client_id):
+        try:
+            kid = jwt.get_unverified_header(id_token).get('kid')
+        except jwt.InvalidTokenError as e:
+            raise ProviderError(f'Invalid id_token: {e}') from e
+
+        key = cls.get_signing_key(kid)
+        if key is None:
+            raise ProviderError(f'Unknown id_token signing key {kid}')
+
+        try:
+            claims = jwt.decode(id_token, key=key, algorithms=['RS256'], audience=client_id)
+        except jwt.InvalidTokenError as e:
+            raise ProviderError(f'Invalid id_token: {e}') from e
+
+        issuer = cls.get_endpoint('issuer')
+        if claims.get('iss') not in (issuer, issuer.replace('https://', '')):
+            raise ProviderError(f'Invalid id_token issuer {claims.get("iss")}')
+        return claims
+
+    @classmethod
+    def get_userinfo(cls, client_id, client_secret, code, authorization_response):
+        client = WebApplicationClient(client_id)
+        token = cls.fetch_token(client, client_secret, code, authorization_response)
+
+        id_token = token.get('id_token')
+        if id_token:
+            try:
+                claims = cls.verify_id_token(id_token, client_id)
+            except KeysUnavailable:
+                # let the provider check the token instead
+                claims = {}
+            if 'email' in claims and 'name' in claims:
+                return claims
+
+        return cls.request_userinfo(client)
+
 
 class FacebookOAuth2Client(OAuth2Client):
     provider = 'facebook'
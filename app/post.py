@@ -1,142 +1,597 @@
+import re
+import json
+import base64
+import hashlib
+from datetime import datetime
+from functools import partial
+from operator import itemgetter
+from collections import namedtuple
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import load_only, joinedload
 from flask.views import MethodView
 from flask import (
     request,
     Blueprint,
+    Response,
     abort,
+    current_app,
+    stream_with_context,
 )
+from werkzeug.http import http_date, is_resource_modified
 from flask_login import (
     login_required,
     current_user,
 )
 
+from . import cache, feed, likes, serialization
 from .models import (
     Post,
     User,
     Like,
     db,
+    use_primary,
+)
+
+
+def validate_post(data):
+    """Column values of a new post, raises ValueError when data is invalid"""
+    if not data:
+        raise ValueError('Data is empty')
+
+    if not isinstance(data, dict):
+        raise ValueError('Post must be an object')
+
+    title = data.get('title')
+    if not title:
+        raise ValueError('Title is required')
+
+    body = data.get('body')
+    if not body:
+        raise ValueError('Body is required')
+
+    for name, value in (('Title', title), ('Body', body)):
+        if not isinstance(value, str):
+            raise ValueError(f'{name} must be a string')
+        max_length = Post.__table__.c[name.lower()].type.length
+        if len(value) > max_length:
+            raise ValueError(f'{name} must be at most {max_length} characters')
+
+    return {
+        'title': title,
+        'summary': body[:200] + '...' if len(body) > 200 else body,
+        'body': body,
+    }
+
+
+def lock_author(author_id):
+    """Lock the author row until the commit, so that the newest posts of the author
+    are the ones inserted in this transaction, see PostBatchAPI._insert"""
+    db.session.query(User.id).filter(User.id == author_id).with_for_update().one()  #pylint:disable=E1101
+
+
+# the columns of the posts lists, read as plain tuples instead of Post instances
+POST_ROW_COLUMNS = (
+    Post.id,
+    Post.title,
+    Post.summary,
+    Post.n_likes,
+    Post.author_id,
+    User.name.label('author_name'),
+    Post.created_at,
+    Post.updated_at,
+    Post.first_liker_name,
+    Post.second_liker_name,
 )
 
+PostRow = namedtuple('PostRow', [column.key for column in POST_ROW_COLUMNS])
+
+# fields of ?fields=, in the order of the responses
+LIST_FIELDS = ('id', 'title', 'summary', 'like_string', 'author_id', 'author_name')
+
+DETAIL_FIELDS = ('id', 'title', 'body', 'author', 'like_string', 'created_at', 'updated_at')
+
+# columns read for every response, for the cursors, ETags and like counters
+BASE_COLUMNS = ('id', 'created_at', 'updated_at')
+
+LIKE_STRING_COLUMNS = ('n_likes', 'first_liker_name', 'second_liker_name')
+
+
+def get_fields(allowed):
+    """The fields of ?fields= and the id in the order of allowed, all of them by default"""
+    value = request.args.get('fields', default='', type=str)
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    if not fields:
+        return allowed
+
+    unknown = fields.difference(allowed)
+    if unknown:
+        abort(400, f'Unknown fields: {", ".join(sorted(unknown))}')
+    fields.add('id')
+    return tuple(field for field in allowed if field in fields)
+
+
+def get_columns(fields):
+    """Names of the columns needed to render fields"""
+    columns = set(BASE_COLUMNS)
+    for field in fields:
+        if field == 'like_string':
+            columns.update(LIKE_STRING_COLUMNS)
+        elif field == 'author':
+            columns.add('author_id')
+        else:
+            columns.add(field)
+    return columns
+
+
+def list_dicts(rows, fields, like_strings=None):
+    """The fields of rows as dicts"""
+    shown = [field for field in fields if field != 'like_string']
+    indexes = [PostRow._fields.index(field) for field in shown]
+    if len(indexes) > 1:
+        values = itemgetter(*indexes)
+    else:
+        values = lambda row: (row[indexes[0]],)     #pylint:disable=C3001
+
+    if like_strings is None:
+        return [dict(zip(shown, values(row))) for row in rows]
+    return [
+        dict(zip(shown, values(row)), like_string=like_strings[row[0]])
+        for row in rows
+    ]
+
+
+def encode_cursor(*values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(types):
+            raise ValueError(cursor)
+        return [convert(value) for convert, value in zip(types, values)]
+    except (ValueError, TypeError):
+        abort(400, 'Cursor is invalid')
+
+
+def get_validators(posts, like_state, columns):
+    """Strong ETag and Last-Modified of a response made of posts, without rendering it
+
+    The timestamps have a resolution of one second, so the shown columns are part of
+    the ETag too. like_state is None when the likes are not shown.
+    """
+    versions = []
+    last_modified = None
+    for post in posts:
+        changed = post.updated_at or post.created_at
+        version = [post.id]
+        if like_state is not None:
+            n_likes, touched = like_state[post.id]
+            if touched:
+                changed = max(changed, datetime.utcfromtimestamp(touched))
+            version += [n_likes, touched]
+        last_modified = changed if last_modified is None else max(last_modified, changed)
+        versions.append([
+            *version,
+            changed.isoformat(),
+            *[getattr(post, column) for column in columns],
+        ])
+
+    etag = hashlib.sha1(json.dumps(versions).encode()).hexdigest()
+    return etag, http_date(last_modified) if last_modified else None
+
+
+def conditional_headers(etag, last_modified):
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': current_app.config['POST_CACHE_CONTROL'],
+    }
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+    return headers
+
+
+def is_modified(etag, last_modified):
+    return is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
 
 class PostAPI(MethodView):
-    def _create_like_string_from_post(self, post):
-        like_string = ''
-        n_likes = post.n_likes
-        if n_likes:
-            users = db.session.query(User).join(        #pylint:disable=E1101
-                Like,
-                User.id == Like.user_id
-            ).filter(
-                Like.post_id==post.id,
-            ).limit(2).all()
-            if n_likes == 1:
-                like_string = users[0].name
-            else:
-                like_string = f'{users[0].name}, {users[1].name}'
+    @staticmethod
+    def _format_like_string(n_likes, names):
+        if n_likes <= 0:
+            return ''
+
+        # the count and the stored names are updated apart, so there may be fewer names than likes
+        shown = [name for name in names[:2] if name][:n_likes]
+        others = n_likes - len(shown)
+        if not shown:
+            like_string = f'{others} people'
+        else:
+            like_string = ', '.join(shown)
+            if others:
+                like_string += f', and {others} other people'
+        return like_string + ' liked this post.'
+
+    def _create_like_strings_from_posts(self, posts, n_likes=None):
+        if n_likes is None:
+            n_likes = likes.get_like_counts(posts)
+
+        return {
+            post.id: self._format_like_string(
+                n_likes[post.id],
+                [name for name in (post.first_liker_name, post.second_liker_name) if name is not None],
+            )
+            for post in posts
+        }
+
+    @staticmethod
+    def _list_query(fields, *columns):
+        """Query of PostRow columns, NULL for the ones which fields do not need"""
+        needed = get_columns(fields)
+        query = db.session.query(       #pylint:disable=E1101
+            *[
+                column if column.key in needed else sa.null().label(column.key)
+                for column in POST_ROW_COLUMNS
+            ],
+            *columns,
+        ).select_from(Post)
+        if 'author_name' in needed:
+            query = query.join(User, User.id == Post.author_id)
+        return query
+
+    def _serialize_list(self, rows, fields, n_likes=None):
+        like_strings = None
+        if 'like_string' in fields:
+            like_strings = self._create_like_strings_from_posts(rows, n_likes)
+        return list_dicts(rows, fields, like_strings)
+
+    def _create_like_string_from_post(self, post, n_likes=None):
+        return self._create_like_strings_from_posts([post], n_likes)[post.id]
+
+    def _get_post_entry(self, post_id, fields=DETAIL_FIELDS):
+        options = [load_only(*get_columns(fields))]
+        if 'author' in fields:
+            options.append(joinedload(Post.author))
+        post = Post.query.options(*options).get(post_id)
+        if not post:
+            return None
+
+        like_state = None
+        data = post.to_dict(field for field in fields if field != 'like_string')
+        if 'like_string' in fields:
+            like_state = likes.get_like_state([post])
+            data['like_string'] = self._create_like_string_from_post(post, {post.id: like_state[post.id][0]})
+
+        shown = [field for field in ('title', 'body') if field in fields]
+        if 'author' in fields:
+            shown.append('author_name')
+        etag, last_modified = get_validators([post], like_state, columns=shown)
+        return {
+            # the response is served from the cache without decoding it
+            'body': serialization.dumps({'data': data}).decode(),
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+    def _load_post_entry(self, post_id, fields=DETAIL_FIELDS):
+        # a lagging replica would put an outdated post back in the cache after an invalidation
+        with use_primary():
+            return self._get_post_entry(post_id, fields)
+
+    def _query_list(self, fields, per_page, author_id=None, after=None, page=0):
+        query = self._list_query(fields)
+        if author_id is not None:
+            query = query.filter(Post.author_id == author_id)
+        query = query.order_by(Post.created_at.desc(), Post.id.desc())
 
-            if n_likes > 2:
-                like_string += f', and {n_likes-2} other people'
+        if after is not None:
+            created_at, last_id = after
+            query = query.filter(sa.or_(
+                Post.created_at < created_at,
+                sa.and_(Post.created_at == created_at, Post.id < last_id),
+            ))
+        else:
+            query = query.offset(page * per_page)
 
-            like_string += ' liked this post.'
-        return like_string
+        return [PostRow._make(row) for row in query.limit(per_page)]
+
+    def _hydrate(self, fields, post_ids):
+        """The posts of post_ids in the same order, or None when some are missing"""
+        if not post_ids:
+            return []
+        posts = {
+            row.id: PostRow._make(row)
+            for row in self._list_query(fields).filter(Post.id.in_(post_ids))
+        }
+        if len(posts) != len(post_ids):
+            return None
+        return [posts[post_id] for post_id in post_ids]
 
     def get(self, post_id):
         if post_id is None:
-            loaded_fields = load_only('id', 'title', 'summary', 'n_likes', 'author_id',)
-
             author_id = request.args.get('author_id', type=int)
-            if author_id is not None:
-                query = db.session.query(Post).filter(      #pylint:disable=E1101
-                    Post.author_id == author_id
-                )
+            per_page = max(1, min(request.args.get('per_page', default=10, type=int), 50))
+            fields = get_fields(LIST_FIELDS)
+
+            after = None
+            page = 0
+            cursor = request.args.get('cursor', type=str)
+            if cursor:
+                after = decode_cursor(cursor, datetime.fromisoformat, int)
             else:
-                query = db.session.query(Post)     #pylint:disable=E1101
+                page = request.args.get('page', default=0, type=int)
 
-            query = query.options(loaded_fields).order_by(Post.created_at.desc())
+            # the Redis feed index pages the posts, SQL only loads them by id
+            items = None
+            post_ids = feed.get_post_ids(per_page, author_id=author_id, after=after, offset=page * per_page)
+            if post_ids is not None:
+                items = self._hydrate(fields, post_ids)
+            if items is None:
+                items = self._query_list(fields, per_page, author_id=author_id, after=after, page=page)
 
-            page = request.args.get('page', default=0, type=int)
-            per_page = min(request.args.get('per_page', default=10, type=int), 50)
+            like_state = None
+            n_likes = None
+            if 'like_string' in fields:
+                like_state = likes.get_like_state(items)
+                n_likes = {post_id: n for post_id, (n, _) in like_state.items()}
+            shown = [field for field in fields if field not in ('id', 'like_string')]
+            etag, last_modified = get_validators(items, like_state, shown)
+            headers = conditional_headers(etag, last_modified)
+            if not is_modified(etag, last_modified):
+                return '', 304, headers
 
-            query = query.offset(page * per_page).limit(per_page)
+            next_cursor = None
+            if items and len(items) == per_page:
+                next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
 
-            posts = []
-            for item in query:
-                posts.append({
-                    'id': item.id,
-                    'title': item.title,
-                    'summary': item.summary,
-                    'like_string': self._create_like_string_from_post(item),
-                    'author_id': item.author_id,
-                    'author_name': item.author.name,
-                })
             return {
-                'posts': posts
-            }, 200
+                'posts': self._serialize_list(items, fields, n_likes),
+                'next_cursor': next_cursor,
+            }, 200, headers
 
 
         # get a specify post
-        post = Post.query.get(post_id)
-        if not post:
+        fields = get_fields(DETAIL_FIELDS)
+        entry = cache.get_post(post_id, partial(self._load_post_entry, post_id, fields), fields)
+        if entry is None:
             return {
                 'message': 'Post not found',
             }, 404
+
+        headers = conditional_headers(entry['etag'], entry['last_modified'])
+        if not is_modified(entry['etag'], entry['last_modified']):
+            return '', 304, headers
+        return serialization.json_response(entry['body'].encode()), 200, headers
+
+    @login_required
+    def post(self):
+        try:
+            values = validate_post(request.json)
+        except ValueError as e:
+            abort(400, str(e))
+
+        lock_author(current_user.id)
+        post = Post(author_id=current_user.id, **values)
+        post.save()
+
         return {
+            'message': 'Post is created',
             'data': {
-                **post.to_dict(),
-                'like_string': self._create_like_string_from_post(post),
-            },
+                'id': post.id,
+            }
+        }, 201
+
+
+class PostSearchAPI(PostAPI):
+    @staticmethod
+    def _matches(q, words):
+        """Subquery of the ids of the matching posts with their rank, best first"""
+        if db.engine.dialect.name == 'mysql':
+            match = 'MATCH (title, summary, body) AGAINST (:q IN NATURAL LANGUAGE MODE)'
+            statement = f'SELECT id, -{match} AS rank FROM posts WHERE {match}'
+        else:
+            # quoted words, so FTS5 operators in q are searched as plain words
+            q = ' '.join(f'"{word}"' for word in words)
+            statement = (
+                'SELECT rowid AS id, bm25(posts_fts, 4.0, 1.0, 1.0) AS rank '
+                'FROM posts_fts WHERE posts_fts MATCH :q'
+            )
+        return sa.text(statement).bindparams(q=q).columns(
+            id=sa.Integer,
+            rank=sa.Float,
+        ).subquery('matches')
+
+    def get(self):
+        q = request.args.get('q', default='', type=str)
+        words = re.findall(r'\w+', q)
+        if not words:
+            abort(400, 'Query is required')
+
+        fields = get_fields(LIST_FIELDS)
+        matches = self._matches(q, words)
+        query = self._list_query(
+            fields,
+            matches.c.rank,
+        ).join(
+            matches,
+            matches.c.id == Post.id,
+        ).order_by(matches.c.rank, Post.id)
+
+        per_page = max(1, min(request.args.get('per_page', default=10, type=int), 50))
+
+        cursor = request.args.get('cursor', type=str)
+        if cursor:
+            rank, last_id = decode_cursor(cursor, float, int)
+            query = query.filter(sa.or_(
+                matches.c.rank > rank,
+                sa.and_(matches.c.rank == rank, Post.id > last_id),
+            ))
+
+        rows = query.limit(per_page).all()
+
+        next_cursor = None
+        if rows and len(rows) == per_page:
+            next_cursor = encode_cursor(rows[-1].rank, rows[-1].id)
+
+        return {
+            'posts': self._serialize_list([PostRow._make(row[:-1]) for row in rows], fields),
+            'next_cursor': next_cursor,
         }, 200
 
+
+class PostBatchAPI(MethodView):
+    @staticmethod
+    def _insert(author_id, rows):
+        """Insert rows with one multi-row INSERT and return their (id, author_id, created_at) in order"""
+        lock_author(author_id)
+        db.session.execute(Post.__table__.insert().values(rows))   #pylint:disable=E1101
+
+        # the ids of one INSERT are not always consecutive, so they are read back
+        posts = db.session.query(Post.id, Post.author_id, Post.created_at).filter(    #pylint:disable=E1101
+            Post.author_id == author_id,
+        ).order_by(Post.id.desc()).limit(len(rows)).all()
+        return posts[::-1]
+
     @login_required
     def post(self):
         data = request.json
+        items = data.get('posts') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
+            abort(400, 'Posts are required')
 
-        if not data:
-            abort(400, 'Data is empty')
+        limit = current_app.config['POST_BATCH_LIMIT']
+        if len(items) > limit:
+            abort(400, f'At most {limit} posts can be created at once')
 
-        title = data.get('title')
-        if not title:
-            abort(400, 'Title is required')
+        rows, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                rows.append(dict(validate_post(item), author_id=current_user.id))
+            except ValueError as e:
+                errors.append({'index': index, 'message': str(e)})
 
-        body = data.get('body')
-        if not body:
-            abort(400, 'Body is required')
+        if not rows:
+            return {
+                'message': 'No post is created',
+                'data': {
+                    'ids': [None] * len(items),
+                    'errors': errors,
+                }
+            }, 400
 
-        post = Post(
-            title=title,
-            summary=body[:200] + '...' if len(body) > 200 else body,
-            body=body,
-            author_id=current_user.id,
-        )
-        post.save()
+        posts = self._insert(current_user.id, rows)
+        db.session.commit()     #pylint:disable=E1101
+        feed.add_posts(posts)
 
+        created = (post.id for post in posts)
+        failed = {error['index'] for error in errors}
         return {
-            'message': 'Post is created',
+            'message': f'{len(rows)} posts are created',
             'data': {
-                'id': post.id,
+                'ids': [None if index in failed else next(created) for index in range(len(items))],
+                'errors': errors,
             }
         }, 201
 
 
 class LikeAPI(MethodView):
+    @staticmethod
+    def _stream_users(query):
+        for _, user_id, name in query.yield_per(1000):
+            yield serialization.dumps({'id': user_id, 'name': name}, pretty=False)
+
     def get(self, post_id):
-        query = db.session.query(User).join(        #pylint:disable=E1101
-            Like,
+        query = db.session.query(       #pylint:disable=E1101
+            Like.id,
+            User.id,
+            User.name,
+        ).join(
+            User,
             User.id == Like.user_id
         ).filter(
             Like.post_id == post_id
-        )
+        ).order_by(Like.id)
+
+        if request.args.get('stream', default=0, type=int):
+            return Response(
+                stream_with_context(self._stream_users(query)),
+                mimetype='application/x-ndjson',
+            )
+
+        per_page = max(1, min(request.args.get('per_page', default=50, type=int), 500))
+
+        cursor = request.args.get('cursor', type=str)
+        if cursor:
+            last_id, = decode_cursor(cursor, int)
+            query = query.filter(Like.id > last_id)
+
+        rows = query.limit(per_page).all()
 
         users = []
-        for item in query:
+        for _, user_id, name in rows:
             users.append({
-                'id': item.id,
-                'name': item.name,
+                'id': user_id,
+                'name': name,
             })
+
+        next_cursor = None
+        if rows and len(rows) == per_page:
+            next_cursor = encode_cursor(rows[-1][0])
+
         return {
             'users': users,
+            'next_cursor': next_cursor,
         }
 
+    @login_required
+    def post(self, post_id):
+        if not db.session.query(Post.id).filter(Post.id == post_id).scalar():    #pylint:disable=E1101
+            abort(404, 'Post not found')
+
+        try:
+            Like(user_id=current_user.id, post_id=post_id).save()
+        except IntegrityError:
+            # liked already
+            db.session.rollback()   #pylint:disable=E1101
+            return {
+                'message': 'Post is liked',
+            }, 200
+
+        likes.add_delta(post_id, 1)
+        # the entry may have been filled again with the old count since the save invalidated it,
+        # the delta is not counted before the commit so that readers never see more likes than likers
+        cache.invalidate_post(post_id)
+        return {
+            'message': 'Post is liked',
+        }, 201
+
+    @login_required
+    def delete(self, post_id):
+        n_deleted = Like.query.filter(
+            Like.user_id == current_user.id,
+            Like.post_id == post_id,
+        ).delete(synchronize_session=False)
+
+        if n_deleted:
+            # counted down before the row goes away so that readers never see
+            # more likes than likers
+            likes.add_delta(post_id, -1)
+            try:
+                likes.on_unlike(post_id, current_user.id)
+                db.session.commit()     #pylint:disable=E1101
+            except Exception:
+                likes.add_delta(post_id, 1)
+                raise
+            cache.invalidate_post(post_id)
+
+        return {
+            'message': 'Post is unliked',
+        }, 200
+
 
 bp = Blueprint('post', __name__)
 
@@ -144,6 +599,8 @@ post_view = PostAPI.as_view('post_view')
 bp.add_url_rule('', defaults={'post_id': None}, view_func=post_view, methods=['GET',])
 bp.add_url_rule('', view_func=post_view, methods=['POST'])
 bp.add_url_rule('/<int:post_id>', view_func=post_view, methods=['GET',])
+bp.add_url_rule('/search', view_func=PostSearchAPI.as_view('post_search_view'), methods=['GET'])
+bp.add_url_rule('/batch', view_func=PostBatchAPI.as_view('post_batch_view'), methods=['POST'])
 
 like_view = LikeAPI.as_view('like_view')
-bp.add_url_rule('/<int:post_id>/likes', view_func=like_view, methods=['GET',])
+bp.add_url_rule('/<int:post_id>/likes', view_func=like_view, methods=['GET', 'POST', 'DELETE'])
@@ -0,0 +1,125 @@
+import time
+import logging
+import itertools
+import threading
+from functools import partial
+
+import sqlalchemy as sa
+from flask import current_app, g, request
+from flask_login import current_user
+
+from . import auth
+from .models import db
+
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class ReplicaSet:
+    """Round-robin over the replica binds, skipping the ones which failed recently
+
+    Shared by the threads of a worker.
+    """
+
+    def __init__(self, binds, cooldown):
+        self.binds = binds
+        self.cooldown = cooldown
+        self._failed_at = {}
+        self._watched = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self):
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.binds)):
+                bind = self.binds[next(self._counter) % len(self.binds)]
+                failed_at = self._failed_at.get(bind)
+                if failed_at is None or now - failed_at >= self.cooldown:
+                    return bind
+        return None
+
+    def mark_failed(self, bind):
+        logger.warning('Replica %s failed, skipping it for %s seconds', bind, self.cooldown)
+        with self._lock:
+            self._failed_at[bind] = time.monotonic()
+
+    def _on_error(self, bind, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, sa.exc.OperationalError):
+            self.mark_failed(bind)
+
+    def watch(self, app, bind):
+        # the engines are created on first use
+        with self._lock:
+            if bind not in self._watched:
+                engine = db.get_engine(app, bind=bind)
+                sa.event.listen(engine, 'handle_error', partial(self._on_error, bind))
+                self._watched.add(bind)
+
+
+def _sticky_key(user_id):
+    return f'db:sticky:{user_id}'
+
+
+def before_request():
+    replicas = current_app.extensions['replicas']
+    if request.method not in READ_METHODS:
+        return
+    if request.endpoint not in current_app.config['REPLICA_READ_ENDPOINTS']:
+        return
+
+    # read your writes, the replicas may not have them yet
+    if current_user.is_authenticated and auth.redis.exists(_sticky_key(current_user.id)):
+        return
+
+    bind = replicas.choose()
+    if bind is not None:
+        replicas.watch(current_app._get_current_object(), bind)     #pylint:disable=W0212
+        g.db_replica = bind
+
+
+def after_request(response):
+    if request.method not in READ_METHODS and response.status_code < 400 \
+            and current_user.is_authenticated:
+        auth.redis.set(
+            _sticky_key(current_user.id),
+            1,
+            ex=current_app.config['REPLICA_STICKY_SECONDS'],
+        )
+    return response
+
+
+def retry_on_primary(e):
+    """Run a read which failed on its replica again on the primary, within the same request
+
+    Only the GET and HEAD requests of REPLICA_READ_ENDPOINTS are retried, their views
+    have no side effects to repeat.
+    """
+    replica = g.pop('db_replica', None)
+    if replica is None or request.method not in READ_METHODS \
+            or request.endpoint not in current_app.config['REPLICA_READ_ENDPOINTS']:
+        raise e
+    logger.warning('Read of %s failed on replica %s, retrying on the primary', request.endpoint, replica)
+    db.session.rollback()   #pylint:disable=E1101
+    return current_app.dispatch_request()
+
+
+def teardown_request(exc):
+    g.pop('db_replica', None)
+
+
+def init_app(app):
+    binds = sorted(
+        bind for bind in (app.config.get('SQLALCHEMY_BINDS') or {})
+        if bind.startswith('replica_')
+    )
+    if not binds:
+        return
+
+    app.extensions['replicas'] = ReplicaSet(binds, app.config['REPLICA_COOLDOWN'])
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.register_error_handler(sa.exc.OperationalError, retry_on_primary)
@@ -0,0 +1,128 @@
+import json
+from datetime import date, datetime, timezone
+
+from flask import Flask, current_app
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def isoformat(value):
+    # naive datetimes are UTC, see models.Timestamp
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """Flask's encoder with ISO-8601 dates and SQLAlchemy rows as objects"""
+
+    def default(self, o):   #pylint:disable=E0202
+        if isinstance(o, date):
+            return isoformat(o)
+        if hasattr(o, '_mapping'):
+            return dict(o._mapping)
+        return super().default(o)
+
+
+def _orjson_default(obj):
+    # named tuples are arrays like with the json module
+    if isinstance(obj, tuple):
+        return list(obj)
+    if hasattr(obj, '_mapping'):
+        return dict(obj._mapping)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class StdlibBackend:
+    name = 'json'
+
+    def __init__(self, sort_keys=True, ensure_ascii=True):
+        self.sort_keys = sort_keys
+        self.ensure_ascii = ensure_ascii
+
+    def dumps(self, obj, pretty=False):
+        return json.dumps(
+            obj,
+            cls=JSONEncoder,
+            sort_keys=self.sort_keys,
+            ensure_ascii=self.ensure_ascii,
+            indent=2 if pretty else None,
+            separators=(',', ': ') if pretty else (',', ':'),
+        ).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonBackend:
+    """orjson always writes UTF-8, ensure_ascii is ignored"""
+
+    name = 'orjson'
+
+    def __init__(self, sort_keys=True, ensure_ascii=True):
+        self.option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            self.option |= orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj, pretty=False):
+        option = self.option | orjson.OPT_INDENT_2 if pretty else self.option
+        return orjson.dumps(obj, default=_orjson_default, option=option)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def get_backend(name='auto', **kwargs):
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError('JSON_BACKEND is orjson but orjson is not installed')
+        return OrjsonBackend(**kwargs)
+    if name == 'json':
+        return StdlibBackend(**kwargs)
+    raise RuntimeError(f'Unknown JSON_BACKEND {name}')
+
+
+def dumps(obj, pretty=None):
+    """The body of a JSON response, with the trailing newline of jsonify"""
+    if pretty is None:
+        pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+    return current_app.json_backend.dumps(obj, pretty=pretty) + b'\n'
+
+
+def loads(data):
+    return current_app.json_backend.loads(data)
+
+
+def json_response(body):
+    return current_app.response_class(body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+class App(Flask):
+    """Serializes the dicts returned by the views with the configured JSON_BACKEND"""
+
+    json_encoder = JSONEncoder
+
+    json_backend = None
+
+    def make_response(self, rv):
+        if isinstance(rv, tuple) and rv and isinstance(rv[0], dict):
+            rv = (json_response(dumps(rv[0])),) + rv[1:]
+        elif isinstance(rv, dict):
+            rv = json_response(dumps(rv))
+        return super().make_response(rv)
+
+
+def init_app(app):
+    app.json_backend = get_backend(
+        app.config['JSON_BACKEND'],
+        sort_keys=app.config['JSON_SORT_KEYS'],
+        ensure_ascii=app.config['JSON_AS_ASCII'],
+    )
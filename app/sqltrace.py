@@ -0,0 +1,158 @@
+import re
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask import current_app, g, request
+
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+')
+
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+_SPACE = re.compile(r'\s+')
+
+# traces being recorded by the current thread (greenlet under gevent)
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(statement):
+    """The statement with literals, placeholders and IN lists replaced by ?"""
+    statement = _STRING.sub('?', statement)
+    statement = _PLACEHOLDER.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _LIST.sub('(?)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+class Trace:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        return {
+            statement: count
+            for statement, count in self.fingerprints.items()
+            if count >= threshold
+        }
+
+    def problems(self, budget, repeat_threshold):
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f'{self.count} SQL statements, budget is {budget}')
+        for statement, count in self.repeated(repeat_threshold).items():
+            problems.append(f'{count} times {statement[:200]}')
+        return problems
+
+
+def _active():
+    if not hasattr(_local, 'traces'):
+        _local.traces = []
+    return _local.traces
+
+
+def start():
+    trace = Trace()
+    _active().append(trace)
+    return trace
+
+
+def stop(trace):
+    if trace in _active():
+        _active().remove(trace)
+
+
+@contextmanager
+def record():
+    trace = start()
+    try:
+        yield trace
+    finally:
+        stop(trace)
+
+
+@contextmanager
+def paused():
+    """The statements of the block are not added to the traces being recorded"""
+    traces = _active()[:]
+    _active().clear()
+    try:
+        yield
+    finally:
+        _active()[:0] = traces
+
+
+@sa.event.listens_for(sa.engine.Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@sa.event.listens_for(sa.engine.Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_started'].pop()
+    for trace in _active():
+        trace.add(statement, duration)
+
+
+@sa.event.listens_for(sa.engine.Engine, 'handle_error')
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def before_request():
+    g.sql_trace = start()
+
+
+def after_request(response):
+    trace = g.get('sql_trace')
+    if trace is None:
+        return response
+    stop(trace)
+
+    config = current_app.config
+    if config['SQL_COUNT_HEADER']:
+        response.headers['X-SQL-Count'] = str(trace.count)
+
+    problems = trace.problems(
+        config['SQL_BUDGETS'].get(request.endpoint, config['SQL_BUDGET_DEFAULT']),
+        config['SQL_REPEAT_THRESHOLD'],
+    )
+    if problems:
+        message = f'{request.method} {request.path} ({request.endpoint}): ' + '; '.join(problems)
+        if config['SQL_BUDGET_RAISE']:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+def teardown_request(exc):
+    trace = g.pop('sql_trace', None)
+    if trace is not None:
+        stop(trace)
+
+
+def init_app(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
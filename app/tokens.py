@@ -0,0 +1,163 @@
+import time
+import hashlib
+
+import click
+import jwt
+from flask import current_app
+from flask.cli import AppGroup
+
+
+LEGACY_KEY = 'alive_token'
+
+
+def digest(token):
+    """SHA-256 of a token, what is kept and sent around in place of the token itself"""
+    if isinstance(token, str):
+        token = token.encode()
+    return hashlib.sha256(token).hexdigest()
+
+
+class TokenStore:
+    """Issued access tokens, each one under its own key expiring with the token
+
+    Tokens are stored by their SHA-256 digest. Every user also has an index
+    of its live digests, scored by expiry time, so all of them can be
+    revoked at once.
+    """
+
+    def __init__(self, redis, max_ttl):
+        self.redis = redis
+        self.max_ttl = max_ttl
+
+    _digest = staticmethod(digest)
+
+    @staticmethod
+    def _token_key(digest):
+        return f'token:{digest}'
+
+    @staticmethod
+    def _user_key(user_id):
+        return f'user_tokens:{user_id}'
+
+    def add(self, token, user_id, ttl, pipeline=None):
+        digest = self._digest(token)
+        user_key = self._user_key(user_id)
+        now = time.time()
+
+        pipe = pipeline if pipeline is not None else self.redis.pipeline()
+        pipe.set(self._token_key(digest), user_id, ex=ttl)
+        pipe.zadd(user_key, {digest: now + ttl})
+        pipe.zremrangebyscore(user_key, '-inf', now)
+        pipe.expire(user_key, self.max_ttl)
+        if pipeline is None:
+            pipe.execute()
+
+    def is_alive(self, token):
+        return bool(self.redis.exists(self._token_key(self._digest(token))))
+
+    def get_ttl(self, token):
+        """Seconds left before the token expires, None when it is not alive"""
+        ttl = self.redis.pttl(self._token_key(self._digest(token)))
+        if ttl == -2:
+            return None
+        # -1 is a key without expiry, left by hand
+        return ttl / 1000 if ttl >= 0 else self.max_ttl
+
+    def revoke(self, token):
+        digest = self._digest(token)
+        token_key = self._token_key(digest)
+        user_id = self.redis.get(token_key)
+
+        pipe = self.redis.pipeline()
+        pipe.delete(token_key)
+        # or it would be migrated again by the next request
+        pipe.srem(LEGACY_KEY, token)
+        if user_id is not None:
+            pipe.zrem(self._user_key(user_id.decode()), digest)
+        pipe.execute()
+
+    def revoke_all(self, user_id):
+        user_key = self._user_key(user_id)
+        digests = self.redis.zrange(user_key, 0, -1)
+
+        pipe = self.redis.pipeline()
+        for digest in digests:
+            pipe.delete(self._token_key(digest.decode()))
+        pipe.delete(user_key)
+        pipe.execute()
+        return len(digests)
+
+    @staticmethod
+    def _decode_legacy(token, secret_key):
+        """(user_id, seconds left) of a token of the old set, 0 seconds when it can not be used"""
+        try:
+            payload = jwt.decode(token, secret_key, algorithms='HS256')
+            # "iss" holds the issue time, "iat" the lifetime in milliseconds
+            return payload['id'], int(payload['iss'] + payload['iat'] / 1000 - time.time())
+        except (jwt.InvalidTokenError, KeyError, TypeError):
+            return None, 0
+
+    def migrate_legacy_token(self, token, secret_key):
+        """Move one token of the old global set into the store
+
+        Lets the tokens issued before the deploy in until `flask tokens migrate`
+        has emptied the set. Returns the seconds left to the token, None when
+        it is not in the set or can not be used anymore.
+        """
+        if not self.redis.sismember(LEGACY_KEY, token):
+            return None
+
+        user_id, ttl = self._decode_legacy(token, secret_key)
+        pipe = self.redis.pipeline()
+        if ttl > 0:
+            self.add(token, user_id, ttl, pipeline=pipe)
+        pipe.srem(LEGACY_KEY, token)
+        pipe.execute()
+        return ttl if ttl > 0 else None
+
+    def migrate_legacy_set(self, secret_key, batch_size=1000):
+        """Move the tokens of the old global set into the store
+
+        Tokens are read in batches with SSCAN and removed from the set once
+        they are stored. Tokens which can not be decoded or are past their
+        lifetime are dropped. Returns (migrated, dropped).
+        """
+        migrated = dropped = 0
+        # members removed while scanning may shift the cursor, passes are
+        # repeated until the set is empty, which also picks up the tokens
+        # still issued by old workers during a rolling deploy
+        while self.redis.scard(LEGACY_KEY):
+            cursor = 0
+            while True:
+                cursor, tokens = self.redis.sscan(LEGACY_KEY, cursor, count=batch_size)
+
+                pipe = self.redis.pipeline()
+                for token in tokens:
+                    user_id, ttl = self._decode_legacy(token, secret_key)
+                    if ttl > 0:
+                        self.add(token, user_id, ttl, pipeline=pipe)
+                        migrated += 1
+                    else:
+                        dropped += 1
+                if tokens:
+                    pipe.srem(LEGACY_KEY, *tokens)
+                pipe.execute()
+
+                if cursor == 0:
+                    break
+        return migrated, dropped
+
+
+cli = AppGroup('tokens', help='Manage issued access tokens.')
+
+
+@cli.command('migrate')
+@click.option('--batch-size', default=1000, show_default=True)
+def migrate_command(batch_size):
+    """Move tokens from the legacy alive_token set to per-token keys."""
+    from . import auth
+    migrated, dropped = auth.token_store.migrate_legacy_set(
+        current_app.config['SECRET_KEY'],
+        batch_size=batch_size,
+    )
+    click.echo(f'Migrated {migrated} tokens, dropped {dropped} expired or invalid tokens')
@@ -0,0 +1,44 @@
+"""Compare two benchmark reports
+
+    $ python -m benchmarks.compare before.json after.json
+"""
+import sys
+import json
+
+
+METRICS = ('throughput_rps', 'p50_ms', 'p99_ms', 'sql_statements')
+
+
+def change(before, after):
+    if not before:
+        return ''
+    return f'{(after - before) / before * 100:+.1f}%'
+
+
+def main(argv=None):
+    argv = argv if argv is not None else sys.argv[1:]
+    if len(argv) != 2:
+        sys.exit('usage: python -m benchmarks.compare BEFORE.json AFTER.json')
+
+    with open(argv[0]) as f:
+        before = json.load(f)
+    with open(argv[1]) as f:
+        after = json.load(f)
+
+    print(f'before: {before["meta"]}')
+    print(f'after:  {after["meta"]}')
+    print()
+    print(f'{"scenario":<26}' + ''.join(f'{metric:>32}' for metric in METRICS))
+    for name, result in after['scenarios'].items():
+        previous = before['scenarios'].get(name)
+        if previous is None:
+            continue
+        cells = [
+            f'{previous[metric]} -> {result[metric]} ({change(previous[metric], result[metric])})'
+            for metric in METRICS
+        ]
+        print(f'{name:<26}' + ''.join(f'{cell:>32}' for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Stand-in OAuth2/OpenID Connect provider for load testing the login flow
+
+    $ python -m benchmarks.fake_provider --port 9000 --latency-ms 50 --error-rate 0.01
+
+Serves the discovery document, authorize, token, userinfo and JWKS endpoints
+for both providers. The app is pointed at it with
+
+    OAUTHLIB_INSECURE_TRANSPORT=1
+    GOOGLE_DISCOVERY_URL=http://localhost:9000/.well-known/openid-configuration
+    FACEBOOK_AUTHORIZATION_ENDPOINT=http://localhost:9000/authorize
+    FACEBOOK_TOKEN_ENDPOINT=http://localhost:9000/token
+    FACEBOOK_USERINFO_ENDPOINT=http://localhost:9000/userinfo
+
+The user who logs in is given by the login_hint parameter of the authorize
+request, its name is derived from the email.
+"""
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+KEY_ID = 'fake-provider-key'
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def _decode(value):
+    return json.loads(base64.urlsafe_b64decode(value.encode()))
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def inject_faults(self):
+        """Sleep for the configured latency, return True if this request should fail"""
+        server = self.server
+        delay = max(random.gauss(server.latency, server.jitter), 0)
+        time.sleep(delay / 1000)
+        if random.random() < server.error_rate:
+            self.send_json(503, {'error': 'temporarily_unavailable'})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        base_url = self.server.base_url
+
+        if url.path == '/.well-known/openid-configuration':
+            self.send_json(200, {
+                'issuer': base_url,
+                'authorization_endpoint': f'{base_url}/authorize',
+                'token_endpoint': f'{base_url}/token',
+                'userinfo_endpoint': f'{base_url}/userinfo',
+                'jwks_uri': f'{base_url}/jwks',
+            })
+            return
+
+        if url.path == '/jwks':
+            self.send_json(200, {'keys': [self.server.jwk]}, {'Cache-Control': 'public, max-age=3600'})
+            return
+
+        if self.inject_faults():
+            return
+
+        if url.path == '/authorize':
+            email = params.get('login_hint', 'user@example.com')
+            code = _encode({'email': email, 'client_id': params.get('client_id'), 'nonce': random.random()})
+            location = params['redirect_uri'] + '?' + urlencode({'code': code, 'state': params.get('state', '')})
+            self.send_response(302)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if url.path == '/userinfo':
+            token = self.headers.get('Authorization', '').replace('Bearer', '').strip()
+            try:
+                email = _decode(token)['email']
+            except (ValueError, KeyError):
+                self.send_json(401, {'error': 'invalid_token'})
+                return
+            self.send_json(200, {'email': email, 'name': email.split('@')[0]})
+            return
+
+        self.send_json(404, {'error': 'not_found'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        if urlparse(self.path).path != '/token':
+            self.send_json(404, {'error': 'not_found'})
+            return
+        if self.inject_faults():
+            return
+
+        params = {name: values[0] for name, values in parse_qs(body).items()}
+        try:
+            grant = _decode(params['code'])
+        except (ValueError, KeyError):
+            self.send_json(400, {'error': 'invalid_grant'})
+            return
+
+        now = int(time.time())
+        id_token = jwt.encode({
+            'iss': self.server.base_url,
+            'aud': grant['client_id'],
+            'sub': grant['email'],
+            'email': grant['email'],
+            'name': grant['email'].split('@')[0],
+            'iat': now,
+            'exp': now + 3600,
+        }, self.server.private_key, algorithm='RS256', headers={'kid': KEY_ID})
+
+        self.send_json(200, {
+            'access_token': _encode({'email': grant['email']}),
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'id_token': id_token,
+        })
+
+
+def make_server(host='127.0.0.1', port=0, latency=0, jitter=0, error_rate=0):
+    """Create the provider server, latency and jitter are in milliseconds"""
+    server = ThreadingHTTPServer((host, port), ProviderHandler)
+    server.daemon_threads = True
+    server.base_url = f'http://{host}:{server.server_port}'
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server.jwk = {
+        **json.loads(RSAAlgorithm.to_jwk(server.private_key.public_key())),
+        'kid': KEY_ID,
+        'alg': 'RS256',
+        'use': 'sig',
+    }
+    return server
+
+
+def start_server(**kwargs):
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a stand-in OAuth2/OpenID Connect provider.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=0, help='mean injected latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='standard deviation of the latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests failing with 503')
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f'Serving on {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Drive concurrent register and login flows through /auth/callback
+
+    $ python -m benchmarks.fake_provider --port 9000 --latency-ms 80 &
+    $ python -m benchmarks.oauth_load --app http://localhost:5000 --users 2000 --concurrency 200
+
+Every flow goes /auth/ -> provider authorize -> /auth/callback, so the
+latency includes the token exchange with the provider and the Redis and
+database work of handle_register and handle_login. All users register
+first, then all of them log in.
+"""
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import statistics
+from collections import Counter
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+_local = threading.local()
+
+
+def get_session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def run_flow(app_url, provider, action, email, timeout):
+    session = get_session()
+    started_at = time.perf_counter()
+    try:
+        resp = session.get(f'{app_url}/auth/', params={'provider': provider, 'action': action},
+                           allow_redirects=False, timeout=timeout)
+        if resp.status_code != 302:
+            return time.perf_counter() - started_at, f'auth {resp.status_code}'
+
+        authorize_url = resp.headers['Location'] + '&' + urlencode({'login_hint': email})
+        resp = session.get(authorize_url, allow_redirects=False, timeout=timeout)
+        if resp.status_code != 302:
+            return time.perf_counter() - started_at, f'authorize {resp.status_code}'
+
+        resp = session.get(resp.headers['Location'], timeout=timeout)
+        status = 'ok' if resp.status_code == 200 else f'callback {resp.status_code}'
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return time.perf_counter() - started_at, status
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def run_phase(args, action, emails):
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda email: run_flow(args.app, args.provider, action, email, args.timeout),
+            emails,
+        ))
+    elapsed = time.perf_counter() - started_at
+
+    latencies = [latency * 1000 for latency, status in results if status == 'ok']
+    statuses = Counter(status for _, status in results)
+    report = {
+        'flows': len(results),
+        'errors': {status: count for status, count in statuses.items() if status != 'ok'},
+        'throughput_fps': round(len(results) / elapsed, 2),
+    }
+    if latencies:
+        report.update({
+            'mean_ms': round(statistics.mean(latencies), 1),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'max_ms': round(max(latencies), 1),
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the OAuth2 register and login flows.')
+    parser.add_argument('--app', default='http://localhost:5000')
+    parser.add_argument('--provider', choices=('google', 'facebook'), default='google')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    run_id = uuid.uuid4().hex[:8]
+    emails = [f'load-{run_id}-{i}@example.com' for i in range(args.users)]
+
+    report = {}
+    for action in ('register', 'login'):
+        report[action] = run_phase(args, action, emails)
+        print(action, report[action], file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Compare loading the posts lists as Post instances and as PostRow tuples
+
+    $ python -m benchmarks.rows --posts 10000
+    $ python -m benchmarks.rows --skip-seed --rows 50 --rows 10000
+
+Measures the CPU time and the peak of allocated memory per row of the query
+and the conversion to dicts, the way the posts lists did before and do now.
+The database is BENCHMARK_DATABASE_URI, as for benchmarks.run.
+"""
+import sys
+import time
+import argparse
+import statistics
+import tracemalloc
+from collections import defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy.orm import load_only, joinedload
+
+from app import create_app
+from app.models import db, Post
+from app.post import LIST_FIELDS, PostAPI, PostRow, list_dicts
+from .seed import seed
+
+
+def load_instances(n_rows):
+    posts = db.session.query(Post).options(
+        load_only(
+            'id', 'title', 'summary', 'n_likes', 'author_id', 'created_at', 'updated_at',
+            'first_liker_name', 'second_liker_name',
+        ),
+        joinedload(Post.author).load_only('id', 'name'),
+    ).order_by(Post.id).limit(n_rows).all()
+    return [
+        {
+            'id': post.id,
+            'title': post.title,
+            'summary': post.summary,
+            'like_string': '',
+            'author_id': post.author_id,
+            'author_name': post.author.name,
+        }
+        for post in posts
+    ]
+
+
+def load_rows(n_rows):
+    rows = [PostRow._make(row) for row in PostAPI._list_query(LIST_FIELDS).order_by(Post.id).limit(n_rows)]
+    return list_dicts(rows, LIST_FIELDS, defaultdict(str))
+
+
+def measure(load, n_rows, repeat):
+    runs = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        load(n_rows)
+        runs.append((time.perf_counter() - started_at) / n_rows * 1e6)
+        db.session.remove()
+
+    tracemalloc.start()
+    load(n_rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+
+    return {
+        'mean_us_per_row': round(statistics.mean(runs), 3),
+        'min_us_per_row': round(min(runs), 3),
+        'peak_bytes_per_row': round(peak / n_rows),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare Post instances and PostRow tuples.')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--rows', type=int, action='append', help='rows per query, 50 and 10000 by default')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data of the last run')
+    args = parser.parse_args(argv)
+
+    app = create_app('benchmark')
+    with app.app_context():
+        if not args.skip_seed:
+            db.drop_all()
+            db.create_all()
+            print('Seeding', seed(args.posts), file=sys.stderr)
+
+        n_posts = db.session.query(sa.func.count(Post.id)).scalar()
+        for n_rows in args.rows or [50, 10000]:
+            if n_rows > n_posts:
+                print(f'Only {n_posts} posts, skipping {n_rows} rows', file=sys.stderr)
+                continue
+            for name, load in (('instances', load_instances), ('rows', load_rows)):
+                print(f'{name}_{n_rows}', measure(load, n_rows, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Benchmark the posts and auth endpoints in process
+
+    $ python -m benchmarks.run --posts 10000 --output before.json
+    $ python -m benchmarks.run --posts 10000 --output after.json --skip-seed
+    $ python -m benchmarks.compare before.json after.json
+
+The database is BENCHMARK_DATABASE_URI, a local SQLite file by default, and
+Redis is replaced by fakeredis, so nothing but the app itself is measured.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+import sqlalchemy as sa
+import jwt
+from flask import current_app
+
+from app import create_app, auth, feed
+from app.models import db, User, Post, Like
+from app.post import encode_cursor
+from .seed import seed
+
+
+class Recorder:
+    def __init__(self, engine):
+        self.statements = 0
+        sa.event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, *args):
+        self.statements += 1
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def measure(client, recorder, make_request, n_requests, warmup):
+    for i in range(warmup):
+        make_request(client, i)
+
+    latencies = []
+    statements = recorder.statements
+    started_at = time.perf_counter()
+    for i in range(n_requests):
+        request_started_at = time.perf_counter()
+        resp = make_request(client, i)
+        latencies.append((time.perf_counter() - request_started_at) * 1000)
+        if resp.status_code >= 400:
+            raise RuntimeError(f'{resp.status_code} {resp.data[:200]}')
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        'requests': n_requests,
+        'throughput_rps': round(n_requests / elapsed, 2),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'sql_statements': round((recorder.statements - statements) / n_requests, 2),
+    }
+
+
+def build_scenarios(n_posts, per_page=50):
+    rng = random.Random(42)
+
+    top_author_id, n_author_posts = db.session.query(
+        Post.author_id,
+        sa.func.count(Post.id),
+    ).group_by(Post.author_id).order_by(sa.func.count(Post.id).desc()).first()
+    viral_post_id = db.session.query(Post.id).order_by(Post.n_likes.desc()).limit(1).scalar()
+
+    deep_page = int(n_posts / per_page * 0.9)
+    deep_post = db.session.query(Post.created_at, Post.id).order_by(
+        Post.created_at.desc(), Post.id.desc()
+    ).offset(deep_page * per_page - 1).limit(1).one()
+    deep_cursor = encode_cursor(deep_post.created_at, deep_post.id)
+
+    deep_author_page = int(n_author_posts / per_page * 0.9)
+
+    user = User.query.get(top_author_id)
+    token = jwt.encode({'id': user.id}, key=current_app.config['SECRET_KEY'], algorithm='HS256')
+    auth.token_store.add(token, user.id, auth.ACCESS_TOKEN_LIFETIME)
+    headers = {'authorization': f'Bearer {token}'}
+    post_ids = [rng.randint(1, n_posts) for _ in range(100000)]
+
+    home_ids = post_ids[:5]
+    home_paths = ['/posts?per_page=5', *[f'/posts/{post_id}' for post_id in home_ids],
+                  *[f'/posts/{post_id}/likes' for post_id in home_ids]]
+
+    def home_screen(client):
+        # the requests of the mobile home screen one by one
+        for path in home_paths:
+            resp = client.get(path, headers=headers)
+        return resp
+
+    etags = {}
+
+    def revalidate(client, url):
+        # a polling client which already has the current version
+        if url not in etags:
+            etags[url] = client.get(url).headers['ETag']
+        return client.get(url, headers={'If-None-Match': etags[url]})
+
+    return {
+        'posts_first_page': lambda client, i: client.get(f'/posts?per_page={per_page}'),
+        'posts_deep_page_offset': lambda client, i: client.get(
+            f'/posts?per_page={per_page}&page={deep_page}'),
+        'posts_deep_page_cursor': lambda client, i: client.get(
+            f'/posts?per_page={per_page}&cursor={deep_cursor}'),
+        'posts_author_first_page': lambda client, i: client.get(
+            f'/posts?per_page={per_page}&author_id={top_author_id}'),
+        'posts_author_deep_page': lambda client, i: client.get(
+            f'/posts?per_page={per_page}&author_id={top_author_id}&page={deep_author_page}'),
+        'posts_first_page_revalidate': lambda client, i: revalidate(client, f'/posts?per_page={per_page}'),
+        'post_detail_random': lambda client, i: client.get(f'/posts/{post_ids[i % len(post_ids)]}'),
+        'post_detail_hot': lambda client, i: client.get(f'/posts/{viral_post_id}'),
+        'post_detail_hot_revalidate': lambda client, i: revalidate(client, f'/posts/{viral_post_id}'),
+        'post_likes_viral': lambda client, i: client.get(f'/posts/{viral_post_id}/likes'),
+        'home_screen_requests': lambda client, i: home_screen(client),
+        'home_screen_batch': lambda client, i: client.post('/batch', headers=headers, json={
+            'requests': home_paths,
+        }),
+        'create_post': lambda client, i: client.post('/posts', headers=headers, json={
+            'title': f'Benchmark post {i}',
+            'body': 'Benchmark body ' * 50,
+        }),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the posts and auth endpoints.')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=None)
+    parser.add_argument('--mean-likes', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--scenario', action='append', help='only run these scenarios')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data of the last run')
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args(argv)
+
+    app = create_app('benchmark')
+    with app.app_context():
+        if not args.skip_seed:
+            db.drop_all()
+            db.create_all()
+            print('Seeding', seed(args.posts, args.users, args.mean_likes), file=sys.stderr)
+
+        # fakeredis starts empty in every run, without the index /posts falls back to SQL
+        print('Indexed', feed.rebuild(), 'posts in the feed', file=sys.stderr)
+
+        n_posts = db.session.query(sa.func.count(Post.id)).scalar()
+        scenarios = build_scenarios(n_posts)
+        recorder = Recorder(db.engine)
+
+        results = {}
+        with app.test_client() as client:
+            for name, make_request in scenarios.items():
+                if args.scenario and name not in args.scenario:
+                    continue
+                results[name] = measure(client, recorder, make_request, args.requests, args.warmup)
+                print(name, results[name], file=sys.stderr)
+
+        db.session.query(Post).filter(Post.title.like('Benchmark post %')).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'date': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'database': db.engine.dialect.name,
+                'json_backend': app.json_backend.name,
+                'posts': n_posts,
+                'likes': db.session.query(sa.func.count(Like.id)).scalar(),
+                'requests': args.requests,
+            },
+            'scenarios': results,
+        }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import random
+from datetime import datetime, timedelta
+
+from app import likes as like_counters
+from app.models import (
+    db,
+    User,
+    Post,
+    Like,
+)
+
+
+def zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def seed(n_posts, n_users=None, mean_likes=3, batch_size=10000, random_seed=42):
+    """Fill an empty database with users, posts and likes
+
+    Posts are written by a few prolific authors and most likes go to a few
+    viral posts, both following a Zipf distribution. The same arguments
+    always produce the same data.
+    """
+    rng = random.Random(random_seed)
+    n_users = n_users or max(n_posts // 10, 100)
+    engine = db.engine
+    now = datetime(2021, 3, 1)
+
+    users = [{
+        'id': i,
+        'name': f'User {i}',
+        'email': f'user{i}@example.com',
+        'created_at': now,
+    } for i in range(1, n_users + 1)]
+    for i in range(0, n_users, batch_size):
+        with engine.begin() as connection:
+            connection.execute(User.__table__.insert(), users[i:i+batch_size])
+
+    user_ids = list(range(1, n_users + 1))
+    author_weights = zipf_weights(n_users)
+    like_weights = zipf_weights(n_posts, s=1.2)
+    total_weight = sum(like_weights)
+    total_likes = n_posts * mean_likes
+
+    n_likes_total = 0
+    for start in range(0, n_posts, batch_size):
+        post_ids = range(start + 1, min(start + batch_size, n_posts) + 1)
+        authors = rng.choices(user_ids, weights=author_weights, k=len(post_ids))
+
+        posts, likes = [], []
+        for post_id, author_id in zip(post_ids, authors):
+            # the zipf rank is shuffled so that viral posts are spread over time
+            rank = (post_id * 7919) % n_posts
+            n_likes = min(int(total_likes * like_weights[rank] / total_weight), n_users)
+            created_at = now - timedelta(seconds=n_posts - post_id)
+
+            posts.append({
+                'id': post_id,
+                'title': f'Post {post_id}',
+                'summary': f'Summary of the post {post_id}',
+                'body': f'Body of the post {post_id}. ' * 20,
+                'author_id': author_id,
+                'n_likes': n_likes,
+                'created_at': created_at,
+            })
+            for user_id in rng.sample(user_ids, n_likes):
+                n_likes_total += 1
+                likes.append({
+                    'user_id': user_id,
+                    'post_id': post_id,
+                    'created_at': created_at,
+                })
+
+        with engine.begin() as connection:
+            connection.execute(Post.__table__.insert(), posts)
+            for i in range(0, len(likes), batch_size):
+                connection.execute(Like.__table__.insert(), likes[i:i+batch_size])
+
+    # the first two likers of every post, the likes were inserted without the on_save hooks
+    like_counters.rebuild_summary(batch_size)
+
+    return {
+        'users': n_users,
+        'posts': n_posts,
+        'likes': n_likes_total,
+    }
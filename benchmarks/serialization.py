@@ -0,0 +1,87 @@
+"""Compare the JSON backends on the payloads of the posts endpoints
+
+    $ python -m benchmarks.serialization --iterations 20000
+
+The whole request is measured by running benchmarks.run with JSON_BACKEND=json
+and JSON_BACKEND=orjson.
+"""
+import sys
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+from app import serialization
+
+
+def list_payload(per_page=50):
+    return {
+        'posts': [
+            {
+                'id': i,
+                'title': f'Post title number {i}',
+                'summary': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 3,
+                'like_string': 'User 1, User 2, and 40 other people liked this post.',
+                'author_id': i % 7,
+                'author_name': f'Author {i % 7}',
+            }
+            for i in range(per_page)
+        ],
+        'next_cursor': 'WyIyMDIxLTAzLTAxVDEyOjMwOjA1IiwgMTIzNDVd',
+    }
+
+
+def detail_payload():
+    created_at = datetime(2021, 3, 1, 12, 30, 5)
+    return {
+        'data': {
+            'id': 1,
+            'title': 'Post title',
+            'body': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 25,
+            'author': {
+                'id': 7,
+                'name': 'Author',
+                'email': 'author@email.com',
+                'occupation': None,
+                'created_at': created_at - timedelta(days=30),
+                'updated_at': None,
+            },
+            'created_at': created_at,
+            'updated_at': created_at + timedelta(hours=1),
+            'like_string': 'User 1, User 2, and 40 other people liked this post.',
+        },
+    }
+
+
+def measure(backend, payload, iterations):
+    runs = []
+    for _ in range(5):
+        started_at = time.perf_counter()
+        for _ in range(iterations):
+            backend.dumps(payload)
+        runs.append((time.perf_counter() - started_at) / iterations * 1e6)
+    return {
+        'bytes': len(backend.dumps(payload)),
+        'mean_us': round(statistics.mean(runs), 3),
+        'min_us': round(min(runs), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the JSON backends.')
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    backends = [serialization.StdlibBackend()]
+    if serialization.orjson is not None:
+        backends.append(serialization.OrjsonBackend())
+    else:
+        print('orjson is not installed, only the json module is measured', file=sys.stderr)
+
+    for payload_name, payload in (('list_50', list_payload()), ('detail', detail_payload())):
+        for backend in backends:
+            print(f'{payload_name}_{backend.name}', measure(backend, payload, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
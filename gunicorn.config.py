@@ -1,5 +1,15 @@
+import os
+import shutil
+import tempfile
 import multiprocessing as mp
 
+# every worker writes its metrics here, /metrics aggregates the files of all workers.
+# Set before the workers import the app so prometheus_client picks the mmaped values.
+prometheus_multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'prometheus-multiproc'),
+)
+
 bind = '0.0.0.0:5000'
 
 backlog = 2048
@@ -41,9 +51,22 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
 proc_name = None
 
 
+def on_starting(server):
+    # files of a previous run would be summed with the new ones
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir)
+
 def post_fork(server, worker):
     server.log.info("Worker spawned (pid: %s)", worker.pid)
 
+    # the pid may belong to a dead worker whose in-flight gauges are still on disk
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
 def pre_fork(server, worker):
     pass
 
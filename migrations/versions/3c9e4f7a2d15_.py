@@ -0,0 +1,64 @@
+"""add the full-text index of posts
+
+Revision ID: 3c9e4f7a2d15
+Revises: 8f2d6c1a9b47
+Create Date: 2026-10-17 14:05:48.731204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e4f7a2d15'
+down_revision = '8f2d6c1a9b47'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_UPGRADE = (
+    "CREATE VIRTUAL TABLE posts_fts USING fts5("
+    "title, summary, body, content='posts', content_rowid='id')",
+    "CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts(rowid, title, summary, body) "
+    "VALUES (new.id, new.title, new.summary, new.body); END",
+    "CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, summary, body) "
+    "VALUES ('delete', old.id, old.title, old.summary, old.body); END",
+    "CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, summary, body ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, summary, body) "
+    "VALUES ('delete', old.id, old.title, old.summary, old.body); "
+    "INSERT INTO posts_fts(rowid, title, summary, body) "
+    "VALUES (new.id, new.title, new.summary, new.body); END",
+    # index the existing posts
+    "INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')",
+)
+
+SQLITE_DOWNGRADE = (
+    'DROP TRIGGER IF EXISTS posts_fts_update',
+    'DROP TRIGGER IF EXISTS posts_fts_delete',
+    'DROP TRIGGER IF EXISTS posts_fts_insert',
+    'DROP TABLE IF EXISTS posts_fts',
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+    elif dialect == 'mysql':
+        # InnoDB builds the first FULLTEXT index in place but does not allow writes meanwhile
+        op.execute(
+            'ALTER TABLE posts ADD FULLTEXT INDEX ft_posts_title_summary_body (title, summary, body), '
+            'ALGORITHM=INPLACE, LOCK=SHARED'
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
+    elif dialect == 'mysql':
+        op.drop_index('ft_posts_title_summary_body', table_name='posts')
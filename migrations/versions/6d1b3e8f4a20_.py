@@ -0,0 +1,46 @@
+"""add the first two likers of posts
+
+Revision ID: 6d1b3e8f4a20
+Revises: 3c9e4f7a2d15
+Create Date: 2026-10-17 16:20:11.508349
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d1b3e8f4a20'
+down_revision = '3c9e4f7a2d15'
+branch_labels = None
+depends_on = None
+
+
+def liker(column, offset):
+    return (
+        f'(SELECT {column} FROM likes JOIN users ON users.id = likes.user_id '
+        f'WHERE likes.post_id = posts.id ORDER BY likes.id LIMIT 1 OFFSET {offset})'
+    )
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('first_liker_id', sa.Integer(), nullable=True))
+    op.add_column('posts', sa.Column('first_liker_name', sa.String(length=50), nullable=True))
+    op.add_column('posts', sa.Column('second_liker_id', sa.Integer(), nullable=True))
+    op.add_column('posts', sa.Column('second_liker_name', sa.String(length=50), nullable=True))
+
+    # the same as `flask likes rebuild-summary`, in one statement
+    op.execute(
+        'UPDATE posts SET '
+        f'first_liker_id = {liker("likes.user_id", 0)}, '
+        f'first_liker_name = {liker("users.name", 0)}, '
+        f'second_liker_id = {liker("likes.user_id", 1)}, '
+        f'second_liker_name = {liker("users.name", 1)}'
+    )
+
+
+def downgrade():
+    op.drop_column('posts', 'second_liker_name')
+    op.drop_column('posts', 'second_liker_id')
+    op.drop_column('posts', 'first_liker_name')
+    op.drop_column('posts', 'first_liker_id')
@@ -0,0 +1,72 @@
+"""add indexes for the posts list and likers lookups
+
+Revision ID: 8f2d6c1a9b47
+Revises: 5036e08b29e5
+Create Date: 2026-10-17 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d6c1a9b47'
+down_revision = '5036e08b29e5'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('ix_posts_author_id_created_at_id', 'posts', ['author_id', 'created_at', 'id'], False),
+    ('ix_posts_created_at_id', 'posts', ['created_at', 'id'], False),
+    ('ix_likes_post_id_created_at', 'likes', ['post_id', 'created_at'], False),
+    ('uq_likes_user_id_post_id', 'likes', ['user_id', 'post_id'], True),
+)
+
+
+# likes scanned by one DELETE of remove_duplicate_likes, so no statement holds its locks for long
+DELETE_BATCH_SIZE = 10000
+
+
+def remove_duplicate_likes():
+    # keep the oldest like of every (user_id, post_id) pair so the unique index can be built
+    bind = op.get_bind()
+    first_id, last_id = bind.execute(sa.text('SELECT MIN(id), MAX(id) FROM likes')).fetchone()
+    if first_id is None:
+        return
+
+    # the derived table lets MySQL read likes in a DELETE from likes
+    statement = sa.text(
+        'DELETE FROM likes WHERE id IN ('
+        'SELECT id FROM (SELECT newer.id FROM likes AS newer JOIN likes AS older '
+        'ON older.user_id = newer.user_id AND older.post_id = newer.post_id AND older.id < newer.id '
+        'WHERE newer.id BETWEEN :low AND :high) AS duplicates'
+        ')'
+    )
+    # every batch is committed on its own
+    with op.get_context().autocommit_block():
+        for low in range(first_id, last_id + 1, DELETE_BATCH_SIZE):
+            bind.execute(statement, {'low': low, 'high': low + DELETE_BATCH_SIZE - 1})
+
+
+def upgrade():
+    remove_duplicate_likes()
+
+    if op.get_bind().dialect.name == 'mysql':
+        # InnoDB online DDL, the tables stay readable and writable while the indexes are built
+        for table in ('posts', 'likes'):
+            clauses = []
+            for name, table_name, columns, unique in INDEXES:
+                if table_name == table:
+                    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+                    clauses.append(f'ADD {kind} {name} ({", ".join(columns)})')
+            op.execute(f'ALTER TABLE {table} {", ".join(clauses)}, ALGORITHM=INPLACE, LOCK=NONE')
+        return
+
+    for name, table_name, columns, unique in INDEXES:
+        op.create_index(name, table_name, columns, unique=unique)
+
+
+def downgrade():
+    for name, table_name, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table_name)
@@ -0,0 +1,29 @@
+"""add the applied flushes of the like counters
+
+Revision ID: a41c7e9d2b58
+Revises: 6d1b3e8f4a20
+Create Date: 2026-10-17 18:42:06.215730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7e9d2b58'
+down_revision = '6d1b3e8f4a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'like_flushes',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('like_flushes')
@@ -0,0 +1,34 @@
+"""index the likes of a post by id for the likers pages
+
+Revision ID: c7f3a9d41e62
+Revises: a41c7e9d2b58
+Create Date: 2026-10-17 19:05:48.630214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f3a9d41e62'
+down_revision = 'a41c7e9d2b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'mysql':
+        # one online ALTER, so the foreign key on post_id keeps an index throughout
+        op.execute(
+            'ALTER TABLE likes ADD INDEX ix_likes_post_id_id (post_id, id), '
+            'DROP INDEX ix_likes_post_id_created_at, ALGORITHM=INPLACE, LOCK=NONE'
+        )
+        return
+
+    op.create_index('ix_likes_post_id_id', 'likes', ['post_id', 'id'], unique=False)
+    op.drop_index('ix_likes_post_id_created_at', table_name='likes')
+
+
+def downgrade():
+    op.create_index('ix_likes_post_id_created_at', 'likes', ['post_id', 'created_at'], unique=False)
+    op.drop_index('ix_likes_post_id_id', table_name='likes')
@@ -0,0 +1,56 @@
+"""make the creation time of posts required
+
+Revision ID: e2b8d5f17c03
+Revises: c7f3a9d41e62
+Create Date: 2026-10-17 20:14:37.902815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8d5f17c03'
+down_revision = 'c7f3a9d41e62'
+branch_labels = None
+depends_on = None
+
+
+# dropped with the old table when SQLite copies posts, see 3c9e4f7a2d15
+SQLITE_TRIGGERS = (
+    "CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts(rowid, title, summary, body) "
+    "VALUES (new.id, new.title, new.summary, new.body); END",
+    "CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, summary, body) "
+    "VALUES ('delete', old.id, old.title, old.summary, old.body); END",
+    "CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, summary, body ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, summary, body) "
+    "VALUES ('delete', old.id, old.title, old.summary, old.body); "
+    "INSERT INTO posts_fts(rowid, title, summary, body) "
+    "VALUES (new.id, new.title, new.summary, new.body); END",
+)
+
+
+def set_nullable(nullable):
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        null = 'NULL' if nullable else 'NOT NULL'
+        op.execute(f'ALTER TABLE posts MODIFY created_at TIMESTAMP {null}, ALGORITHM=INPLACE, LOCK=NONE')
+    elif dialect == 'sqlite':
+        with op.batch_alter_table('posts') as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.TIMESTAMP(), nullable=nullable)
+        for statement in SQLITE_TRIGGERS:
+            op.execute(statement)
+    else:
+        op.alter_column('posts', 'created_at', existing_type=sa.TIMESTAMP(), nullable=nullable)
+
+
+def upgrade():
+    # the posts list pages and validates on created_at
+    op.execute('UPDATE posts SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL')
+    set_nullable(False)
+
+
+def downgrade():
+    set_nullable(True)
@@ -1,6 +1,23 @@
+from contextlib import contextmanager
 from unittest import TestCase
+import sqlalchemy as sa
 import pytest
 
+from app import sqltrace
+from app.models import db
+
+
+@contextmanager
+def query_budget(limit, repeat_threshold=None):
+    """Fails when the block runs more than limit SQL statements, or one statement
+    repeat_threshold times or more"""
+    with sqltrace.record() as trace:
+        yield trace
+
+    problems = trace.problems(limit, repeat_threshold or float('inf'))
+    if problems:
+        raise AssertionError('; '.join(problems))
+
 
 @pytest.mark.usefixtures('client')
 class APITestCase(TestCase):
@@ -8,3 +25,19 @@ class APITestCase(TestCase):
 
     def call_api(self, url, method='GET', params=None, data=None):
         ...
+
+    def assertQueryBudget(self, limit, repeat_threshold=None):
+        return query_budget(limit, repeat_threshold)
+
+    @contextmanager
+    def count_queries(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
@@ -1,6 +1,7 @@
 import pytest
 
 from app import models, create_app
+from . import query_budget as _query_budget
 
 
 @pytest.fixture
@@ -16,3 +17,9 @@ def client(request):
             yield _client
 
         models.db.drop_all()
+
+
+@pytest.fixture
+def query_budget():
+    """with query_budget(2): ... fails the test when the block runs more than 2 SQL statements"""
+    return _query_budget
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+from unittest import mock
+from datetime import datetime
+
+from flask import current_app
+import jwt
+
+from tests import APITestCase
+from app import auth, identity
+from app.oauth2 import GoogleOAuth2Client, FacebookOAuth2Client
+from benchmarks import fake_provider
+from app.models import User
+
+
+class LoadUserTestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.user = User(email='test@email.com', name='Test').save()
+            token = jwt.encode({
+                'id': self.user.id,
+                'name': self.user.name,
+                'email': self.user.email,
+                'iss': datetime.now().timestamp(),
+                'iat': 1000 * 60 * 60 * 24,
+            }, key=current_app.config['SECRET_KEY'], algorithm='HS256')
+
+            self.access_token = token
+            auth.token_store.add(token, self.user.id, auth.ACCESS_TOKEN_LIFETIME)
+
+    def load_user(self):
+        headers = {'authorization': f'Bearer {self.access_token}'}
+        with current_app.test_request_context(headers=headers) as ctx:
+            return auth.load_user_from_request(ctx.request)
+
+    def test_load_user_from_identity_cache(self):
+        assert self.load_user().id == self.user.id
+
+        with self.count_queries() as statements:
+            user = self.load_user()
+        assert user.id == self.user.id
+        assert user.name == 'Test'
+        assert statements == []
+
+    def test_identity_expires_with_its_token(self):
+        with current_app.test_request_context():
+            auth.token_store.add(self.access_token, self.user.id, 2)
+        self.load_user()
+
+        expires_at, _ = auth.identity_cache._entries[auth.token_store._digest(self.access_token)]
+        assert expires_at - time.monotonic() <= 2
+        with mock.patch('app.identity.time.monotonic', return_value=expires_at + 1):
+            assert auth.identity_cache.get(self.access_token) is None
+
+    def test_identity_cache_keeps_no_token(self):
+        self.load_user()
+        key = auth.token_store._digest(self.access_token)
+        assert list(auth.identity_cache._entries) == [key]
+
+        pubsub = auth.redis.pubsub()
+        pubsub.subscribe(identity.CHANNEL)
+        assert pubsub.get_message(timeout=1)['type'] == 'subscribe'
+
+        auth.identity_cache.invalidate_token(self.access_token)
+        message = pubsub.get_message(timeout=1)
+
+        assert not auth.identity_cache._entries
+        assert message['data'] == f'digest:{key}'.encode()
+        pubsub.close()
+
+    def test_load_user_after_user_changed(self):
+        self.load_user()
+        with current_app.test_request_context():
+            self.user.name = 'Changed'
+            self.user.save()
+
+        assert self.load_user().name == 'Changed'
+
+    def test_logout_revokes_cached_token(self):
+        headers = {'authorization': f'Bearer {self.access_token}'}
+        payload = {'title': 'New post', 'body': 'Test create new post'}
+
+        assert self.client.post('/posts', json=payload, headers=headers).status_code == 201
+        assert self.client.get('/auth/logout', headers=headers).status_code == 200
+        assert self.client.post('/posts', json=payload, headers=headers).status_code == 401
+
+    def test_logout_all_revokes_every_token(self):
+        with current_app.test_request_context():
+            other_token = jwt.encode({'id': self.user.id}, key=current_app.config['SECRET_KEY'],
+                                     algorithm='HS256')
+            auth.token_store.add(other_token, self.user.id, auth.LINK_TOKEN_LIFETIME)
+
+        headers = {'authorization': f'Bearer {self.access_token}'}
+        resp = self.client.get('/auth/logout_all', headers=headers)
+        assert resp.status_code == 200
+
+        assert not auth.token_store.is_alive(self.access_token)
+        assert not auth.token_store.is_alive(other_token)
+        assert self.client.get('/auth/logout', headers=headers).status_code == 401
+
+
+class TokenStoreTestCase(APITestCase):
+    def encode(self, user_id, issued_at):
+        return jwt.encode({
+            'id': user_id,
+            'iss': issued_at,
+            'iat': 1000 * auth.ACCESS_TOKEN_LIFETIME,
+        }, key=current_app.config['SECRET_KEY'], algorithm='HS256')
+
+    def test_token_expires_with_its_lifetime(self):
+        token = self.encode(1, datetime.now().timestamp())
+        auth.token_store.add(token, 1, auth.LINK_TOKEN_LIFETIME)
+
+        assert auth.token_store.is_alive(token)
+        assert 0 < auth.redis.ttl(f'token:{auth.token_store._digest(token)}') <= auth.LINK_TOKEN_LIFETIME
+        assert not auth.redis.exists('alive_token')
+
+    def test_legacy_token_is_migrated_on_use(self):
+        with current_app.test_request_context():
+            user = User(email='legacy@email.com', name='Legacy').save()
+        now = datetime.now().timestamp()
+        token = self.encode(user.id, now)
+        expired = self.encode(user.id, now - 2 * auth.ACCESS_TOKEN_LIFETIME)
+        auth.redis.sadd('alive_token', token, expired)
+
+        assert self.client.get('/auth/logout', headers={'authorization': f'Bearer {expired}'}).status_code == 401
+        assert self.client.get('/auth/logout', headers={'authorization': f'Bearer {token}'}).status_code == 200
+
+        # revoked for good, not migrated again
+        assert not auth.redis.exists('alive_token')
+        assert self.client.get('/auth/logout', headers={'authorization': f'Bearer {token}'}).status_code == 401
+
+    def test_migrate_legacy_set(self):
+        now = datetime.now().timestamp()
+        alive = [self.encode(user_id, now) for user_id in range(25)]
+        expired = self.encode(1, now - 2 * auth.ACCESS_TOKEN_LIFETIME)
+        anonymous = jwt.encode({'iss': now, 'iat': 1000 * auth.ACCESS_TOKEN_LIFETIME},
+                               key=current_app.config['SECRET_KEY'], algorithm='HS256')
+        auth.redis.sadd('alive_token', *alive, expired, anonymous, 'garbage')
+
+        migrated, dropped = auth.token_store.migrate_legacy_set(
+            current_app.config['SECRET_KEY'], batch_size=10)
+
+        assert (migrated, dropped) == (25, 3)
+        assert all(auth.token_store.is_alive(token) for token in alive)
+        assert not auth.token_store.is_alive(expired)
+        assert not auth.redis.exists('alive_token')
+
+
+class OAuthCallbackTestCase(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        cls.provider = fake_provider.start_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.shutdown()
+        cls.provider.server_close()
+        os.environ.pop('OAUTHLIB_INSECURE_TRANSPORT')
+
+    def setUp(self):
+        url = self.provider.base_url
+        current_app.config.update({
+            'GOOGLE_CLIENT_ID': 'google-client',
+            'GOOGLE_CLIENT_SECRET': 'google-secret',
+            'GOOGLE_DISCOVERY_URL': f'{url}/.well-known/openid-configuration',
+            'FACEBOOK_CLIENT_ID': 'facebook-client',
+            'FACEBOOK_CLIENT_SECRET': 'facebook-secret',
+            'FACEBOOK_AUTHORIZATION_ENDPOINT': f'{url}/authorize',
+            'FACEBOOK_TOKEN_ENDPOINT': f'{url}/token',
+            'FACEBOOK_USERINFO_ENDPOINT': f'{url}/userinfo',
+        })
+        GoogleOAuth2Client.configure(current_app.config)
+        FacebookOAuth2Client.configure(current_app.config)
+
+    def run_flow(self, provider, action, email):
+        resp = self.client.get(f'/auth/?provider={provider}&action={action}')
+        assert resp.status_code == 302
+        assert resp.location.startswith(self.provider.base_url)
+
+        resp = GoogleOAuth2Client.request('GET', f'{resp.location}&login_hint={email}',
+                                          allow_redirects=False)
+        assert resp.status_code == 302
+        return self.client.get(resp.headers['Location'])
+
+    def test_register_and_login_with_google(self):
+        resp = self.run_flow('google', 'register', 'google@example.com')
+        assert resp.status_code == 200, resp.json
+        user = User.query.filter(User.email == 'google@example.com').one()
+        assert (user.name, user.link_to_google) == ('google', True)
+
+        resp = self.run_flow('google', 'login', 'google@example.com')
+        assert resp.status_code == 200
+        assert auth.token_store.is_alive(resp.json['access_token'])
+
+    def test_register_with_facebook(self):
+        resp = self.run_flow('facebook', 'register', 'facebook@example.com')
+        assert resp.status_code == 200, resp.json
+        assert User.query.filter(User.email == 'facebook@example.com').one().link_to_facebook
+
+    def test_rejected_code_is_a_provider_error(self):
+        state = json.dumps({'provider': 'facebook', 'action': 'login'})
+        resp = self.client.get('/auth/callback', query_string={'code': 'forged', 'state': state})
+        assert resp.status_code == 503
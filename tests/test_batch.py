@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+import jwt
+
+from tests import APITestCase
+from app import auth, batch
+from app.models import User, Post, Like
+
+
+class ThreadPool:
+    """Stands in for gevent.pool.Pool, the calls run in a thread of their own with its contexts"""
+    def __init__(self, size):
+        self.size = size
+
+    def map(self, func, items):
+        # one worker, the in-memory SQLite connection is shared by the threads
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return list(executor.map(func, items))
+
+
+class BatchAPITestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.user = User(email='test@email.com', name='Test').save()
+            self.post = Post(title='Post 1', body='Body 1', summary='Body 1', author_id=self.user.id).save()
+            Like(user_id=self.user.id, post_id=self.post.id).save()
+
+            token = jwt.encode({'id': self.user.id}, key=current_app.config['SECRET_KEY'], algorithm='HS256')
+            auth.token_store.add(token, self.user.id, auth.ACCESS_TOKEN_LIFETIME)
+            self.token = token
+            self.headers = {'authorization': f'Bearer {token}'}
+
+    def test_batch(self):
+        paths = ['/posts?per_page=2', f'/posts/{self.post.id}', f'/posts/{self.post.id}/likes', '/posts/0']
+        resp = self.client.post('/batch', json={'requests': paths})
+
+        assert resp.status_code == 200
+        responses = resp.json['responses']
+        assert [x['status'] for x in responses] == [200, 200, 200, 404]
+        for path, response in zip(paths, responses):
+            assert response['body'] == self.client.get(path).json
+        assert responses[1]['headers']['ETag'] == self.client.get(paths[1]).headers['ETag']
+
+    def test_user_is_loaded_once(self):
+        with mock.patch.object(auth.login_manager, '_request_callback',
+                               wraps=auth.load_user_from_request) as load_user:
+            resp = self.client.post('/batch', headers=self.headers, json={
+                'requests': ['/posts', f'/posts/{self.post.id}', f'/posts/{self.post.id}/likes'],
+            })
+
+        assert [x['status'] for x in resp.json['responses']] == [200, 200, 200]
+        assert load_user.call_count == 1
+
+    def test_batch_in_greenlets(self):
+        paths = ['/posts', f'/posts/{self.post.id}', f'/posts/{self.post.id}/likes', '/posts/0']
+        pool = mock.Mock(side_effect=ThreadPool)
+        with mock.patch.object(batch, 'gevent', SimpleNamespace(pool=SimpleNamespace(Pool=pool))), \
+                mock.patch.object(batch, 'concurrency', return_value=3):
+            resp = self.client.post('/batch', headers=self.headers, json={'requests': paths})
+
+        pool.assert_called_once_with(3)
+        assert resp.status_code == 200
+        responses = resp.json['responses']
+        assert [x['status'] for x in responses] == [200, 200, 200, 404]
+        for path, response in zip(paths, responses):
+            assert response['body'] == self.client.get(path, headers=self.headers).json
+
+    def test_batch_reads_only(self):
+        for path in ('/auth/logout', '/auth/logout_all', '/auth/link_account?provider=google', '/missing'):
+            resp = self.client.post('/batch', headers=self.headers, json={'requests': ['/posts', path]})
+            assert resp.status_code == 400
+            assert resp.json['message'] == 'Request 1 is not an allowed GET path'
+
+        assert self.client.get('/posts', headers=self.headers).status_code == 200
+        assert auth.token_store.is_alive(self.token)
+
+    def test_batch_invalid(self):
+        assert self.client.post('/batch', json={}).status_code == 400
+        assert self.client.post('/batch', json={'requests': ['posts']}).status_code == 400
+        assert self.client.post('/batch', json={'requests': ['//example.com/posts']}).status_code == 400
+
+        current_app.config['BATCH_MAX_REQUESTS'] = 2
+        resp = self.client.post('/batch', json={'requests': ['/posts'] * 3})
+        assert resp.status_code == 400
+        assert resp.json['message'] == 'At most 2 requests can be sent at once'
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import auth, feed
+from app.models import db, User, Post
+from . import APITestCase
+
+
+class FeedTestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            # ids only, the app context of the CLI runner removes the session
+            self.user_ids = [
+                User(email='user1@email.com', name='User 1').save().id,
+                User(email='user2@email.com', name='User 2').save().id,
+            ]
+
+        # several posts share a created_at, like posts created in the same second
+        created_at = datetime(2021, 3, 1, 12, 0, 0)
+        db.session.execute(Post.__table__.insert(), [      #pylint:disable=E1101
+            {
+                'title': f'Post {i}',
+                'body': 'Body',
+                'summary': 'Body',
+                'author_id': self.user_ids[i % 2],
+                'created_at': created_at + timedelta(seconds=i // 3),
+                'n_likes': 0,
+            }
+            for i in range(12)
+        ])
+        db.session.commit()     #pylint:disable=E1101
+
+    def rebuild(self, n_posts=12):
+        result = current_app.test_cli_runner().invoke(args=['feed', 'rebuild', '--batch-size', '5'])
+        assert result.output == f'Indexed {n_posts} posts\n'
+
+    def pages(self, **params):
+        ids = []
+        cursor = None
+        while True:
+            query = dict(params, per_page=5, **({'cursor': cursor} if cursor else {}))
+            resp = self.client.get('/posts', query_string=query)
+            assert resp.status_code == 200
+            ids += [post['id'] for post in resp.json['posts']]
+            cursor = resp.json['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_same_pages_as_sql(self):
+        from_sql = self.pages()
+        author_from_sql = self.pages(author_id=self.user_ids[0])
+
+        self.rebuild()
+        with self.count_queries() as statements:
+            assert self.pages() == from_sql
+        assert self.pages(author_id=self.user_ids[0]) == author_from_sql
+        assert not any('ORDER BY' in statement for statement in statements)
+
+        page = self.client.get('/posts', query_string={'per_page': 5, 'page': 1}).json['posts']
+        assert [post['id'] for post in page] == from_sql[5:10]
+
+    def test_new_posts_are_indexed(self):
+        self.rebuild()
+
+        with current_app.test_request_context():
+            post_id = Post(title='New', body='Body', summary='Body', author_id=self.user_ids[1]).save().id
+
+        assert self.client.get('/posts?per_page=1').json['posts'][0]['id'] == post_id
+        assert auth.redis.zscore(feed.FEED_KEY, feed._member(post_id)) is not None    #pylint:disable=W0212
+
+    def test_fallback_to_sql(self):
+        from_sql = self.pages()
+
+        # cold
+        with self.count_queries() as statements:
+            self.client.get('/posts')
+        assert 'ORDER BY' in statements[0]
+
+        # a post deleted behind the back of the index
+        self.rebuild()
+        db.session.execute(Post.__table__.delete().where(Post.id == from_sql[0]))     #pylint:disable=E1101
+        db.session.commit()     #pylint:disable=E1101
+        assert [post['id'] for post in self.client.get('/posts?per_page=5').json['posts']] == from_sql[1:6]
+
+        # the end of a trimmed index
+        current_app.config['FEED_MAX_LENGTH'] = 4
+        self.rebuild(11)
+        assert self.pages() == from_sql[1:]
@@ -0,0 +1,65 @@
+import os
+import sys
+import subprocess
+import tempfile
+
+from flask import current_app
+from prometheus_client import REGISTRY
+
+from app.models import Post, User
+from . import APITestCase
+
+
+WORKER = '''
+from app import create_app, models
+app = create_app('testing')
+with app.app_context():
+    models.db.create_all()
+    client = app.test_client()
+    client.get('/posts')
+    if sys.argv[1] == 'scrape':
+        sys.stdout.write(client.get('/metrics').get_data(as_text=True))
+'''
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.user = User(email='test@email.com', name='Test').save()
+            self.post = Post(title='Post 1', body='Body 1', summary='Body 1', author_id=self.user.id).save()
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_metrics(self):
+        labels = {'blueprint': 'post', 'endpoint': 'post.post_view'}
+        requests = self.sample('http_request_duration_seconds_count', method='GET', status='200', **labels)
+        statements = self.sample('http_request_sql_statements_sum', **labels)
+        redis_commands = self.sample('redis_command_duration_seconds_count', command='GET')
+
+        self.client.get(f'/posts/{self.post.id}')
+
+        self.assertEqual(self.sample('http_request_duration_seconds_count', method='GET', status='200', **labels), requests + 1)
+        self.assertGreater(self.sample('http_request_sql_statements_sum', **labels), statements)
+        self.assertEqual(self.sample('http_requests_in_flight', **labels), 0)
+        # the post cache is read before loading the post
+        self.assertGreater(self.sample('redis_command_duration_seconds_count', command='GET'), redis_commands)
+
+        res = self.client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_bucket{blueprint="post"', res.data)
+
+    def test_multiple_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            code = 'import sys\n' + WORKER
+            for mode in ('request', 'request', 'scrape'):
+                output = subprocess.run(
+                    [sys.executable, '-c', code, mode],
+                    env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True,
+                ).stdout
+
+        self.assertIn(
+            'http_request_duration_seconds_count{blueprint="post",endpoint="post.post_view",method="GET",status="200"} 3.0',
+            output,
+        )
@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import threading
+from unittest import TestCase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from app.oauth2 import OAuth2Client, GoogleOAuth2Client, ProviderError
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.clients.add(self.client_address)
+        self.server.paths.append(self.path)
+        if self.server.token_status != 200:
+            self.send_json(self.server.token_status, {'error': 'invalid_grant'})
+            return
+        token = {'access_token': 'token', 'token_type': 'Bearer'}
+        if self.server.id_token:
+            token['id_token'] = self.server.id_token
+        self.send_json(200, token)
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        self.server.paths.append(self.path)
+        if self.path == '/.well-known/openid-configuration':
+            if self.server.discovery is None:
+                self.send_json(404, {})
+            else:
+                self.send_json(200, self.server.discovery)
+            return
+        if self.path == '/certs':
+            self.send_json(200, {'keys': self.server.jwks})
+            return
+        if self.path == '/missing':
+            self.send_json(404, {})
+            return
+        if self.path == '/error':
+            self.send_json(401, {'error': {'message': 'Invalid token'}})
+            return
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        elif self.path.startswith('/flaky') and self.server.failures:
+            self.server.failures -= 1
+            self.send_json(503, {})
+            return
+        self.send_json(200, {'email': 'test@email.com', 'name': 'Test'})
+
+
+class LocalOAuth2Client(OAuth2Client):
+    provider = 'local'
+
+
+class ProviderTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ProviderHandler)
+        cls.server.daemon_threads = True
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        os.environ.pop('OAUTHLIB_INSECURE_TRANSPORT')
+
+    def setUp(self):
+        self.server.clients = set()
+        self.server.paths = []
+        self.server.failures = 0
+        self.server.id_token = None
+        self.server.token_status = 200
+
+
+class OAuth2ClientTestCase(ProviderTestCase):
+    def setUp(self):
+        super().setUp()
+        LocalOAuth2Client.configure({
+            'OAUTH_CONNECT_TIMEOUT': 1,
+            'OAUTH_READ_TIMEOUT': 0.2,
+            'OAUTH_MAX_RETRIES': 2,
+            'OAUTH_RETRY_BACKOFF': 0,
+            'OAUTH_POOL_SIZE': 1,
+            'OAUTH_MAX_CONCURRENCY': 1,
+        })
+        LocalOAuth2Client.token_endpoint = f'{self.url}/token'
+        LocalOAuth2Client.userinfo_endpoint = f'{self.url}/userinfo'
+
+    def get_userinfo(self):
+        return LocalOAuth2Client.get_userinfo('client', 'secret', 'code',
+                                              'https://example.com/auth/callback?code=code')
+
+    def test_get_userinfo_reuses_connection(self):
+        for _ in range(3):
+            assert self.get_userinfo() == {'email': 'test@email.com', 'name': 'Test'}
+        assert len(self.server.clients) == 1
+
+    def test_get_userinfo_retries_idempotent_call(self):
+        LocalOAuth2Client.userinfo_endpoint = f'{self.url}/flaky'
+        self.server.failures = 2
+
+        assert self.get_userinfo()['email'] == 'test@email.com'
+        assert self.server.failures == 0
+
+    def test_get_userinfo_times_out(self):
+        LocalOAuth2Client.userinfo_endpoint = f'{self.url}/slow'
+        LocalOAuth2Client.max_retries = 0
+
+        with self.assertRaises(ProviderError):
+            self.get_userinfo()
+
+    def test_token_error_raises_provider_error(self):
+        for status in (400, 503):
+            self.server.token_status = status
+            with self.assertRaises(ProviderError):
+                self.get_userinfo()
+        assert '/userinfo' not in self.server.paths
+
+    def test_userinfo_error_raises_provider_error(self):
+        LocalOAuth2Client.userinfo_endpoint = f'{self.url}/error'
+
+        with self.assertRaises(ProviderError):
+            self.get_userinfo()
+
+    def test_concurrent_calls_are_capped(self):
+        _, _, semaphore = LocalOAuth2Client._get_pool()
+        semaphore.acquire()
+        try:
+            with self.assertRaises(ProviderError):
+                LocalOAuth2Client.request('GET', f'{self.url}/userinfo')
+        finally:
+            semaphore.release()
+
+
+class LocalGoogleOAuth2Client(GoogleOAuth2Client):
+    pass
+
+
+class GoogleOAuth2ClientTestCase(ProviderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.server.jwks = [self.to_jwk(self.key, 'key-1')]
+        self.server.discovery = {
+            'issuer': 'https://accounts.example.com',
+            'token_endpoint': f'{self.url}/token',
+            'userinfo_endpoint': f'{self.url}/userinfo',
+            'jwks_uri': f'{self.url}/certs',
+        }
+        LocalGoogleOAuth2Client.configure({
+            'OAUTH_CONNECT_TIMEOUT': 1,
+            'OAUTH_READ_TIMEOUT': 1,
+            'OAUTH_MAX_RETRIES': 0,
+            'OAUTH_RETRY_BACKOFF': 0,
+            'OAUTH_POOL_SIZE': 1,
+            'OAUTH_MAX_CONCURRENCY': 1,
+            'GOOGLE_DISCOVERY_URL': f'{self.url}/.well-known/openid-configuration',
+            'OIDC_DISCOVERY_TTL': 3600,
+            'OIDC_JWKS_TTL': 3600,
+            'OIDC_JWKS_MIN_REFRESH': 0,
+        })
+
+    @staticmethod
+    def to_jwk(key, kid):
+        return {**json.loads(RSAAlgorithm.to_jwk(key.public_key())), 'kid': kid}
+
+    def sign(self, key, kid, **claims):
+        return jwt.encode({
+            'iss': 'https://accounts.example.com',
+            'aud': 'client',
+            'email': 'google@email.com',
+            'name': 'Google',
+            **claims,
+        }, key, algorithm='RS256', headers={'kid': kid})
+
+    def get_google_userinfo(self):
+        return LocalGoogleOAuth2Client.get_userinfo('client', 'secret', 'code',
+                                                    'https://example.com/auth/callback?code=code')
+
+    def test_userinfo_from_id_token(self):
+        self.server.id_token = self.sign(self.key, 'key-1')
+
+        for _ in range(2):
+            userinfo = self.get_google_userinfo()
+            assert (userinfo['email'], userinfo['name']) == ('google@email.com', 'Google')
+
+        assert '/userinfo' not in self.server.paths
+        assert self.server.paths.count('/.well-known/openid-configuration') == 1
+        assert self.server.paths.count('/certs') == 1
+
+    def test_refresh_jwks_on_unknown_kid(self):
+        self.server.id_token = self.sign(self.key, 'key-1')
+        self.get_google_userinfo()
+
+        rotated = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.server.jwks.append(self.to_jwk(rotated, 'key-2'))
+        self.server.id_token = self.sign(rotated, 'key-2')
+
+        assert self.get_google_userinfo()['email'] == 'google@email.com'
+        assert self.server.paths.count('/certs') == 2
+
+    def test_reject_invalid_id_token(self):
+        forged = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        for id_token in (self.sign(forged, 'key-1'),
+                         self.sign(self.key, 'key-1', aud='other'),
+                         self.sign(self.key, 'key-1', iss='https://evil.example.com')):
+            self.server.id_token = id_token
+            with self.assertRaises(ProviderError):
+                self.get_google_userinfo()
+
+    def test_fallback_endpoints_without_discovery(self):
+        self.server.discovery = None
+        LocalGoogleOAuth2Client.token_endpoint = f'{self.url}/token'
+        LocalGoogleOAuth2Client.userinfo_endpoint = f'{self.url}/userinfo'
+        LocalGoogleOAuth2Client.jwks_uri = f'{self.url}/missing'
+
+        assert self.get_google_userinfo() == {'email': 'test@email.com', 'name': 'Test'}
+        assert '/userinfo' in self.server.paths
+
+    def test_discovery_error_is_not_cached(self):
+        discovery = self.server.discovery
+        self.server.discovery = None
+        LocalGoogleOAuth2Client.token_endpoint = f'{self.url}/fallback'
+        assert LocalGoogleOAuth2Client.get_endpoint('token_endpoint') == f'{self.url}/fallback'
+
+        self.server.discovery = discovery
+        assert LocalGoogleOAuth2Client.get_endpoint('token_endpoint') == f'{self.url}/token'
+        assert self.server.paths.count('/.well-known/openid-configuration') == 2
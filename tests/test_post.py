@@ -1,10 +1,13 @@
+import json
 from datetime import datetime
+from unittest import mock
 
 from flask import current_app
+from redis.exceptions import RedisError
 import jwt
 
 from tests import APITestCase
-from app import auth
+from app import auth, likes, sqltrace
 from app.models import (
     db,
     User,
@@ -61,6 +64,227 @@ class GetPostAPITestCase(APITestCase):
             assert json['title'] == post.title
             assert json['author_id'] == user1.id
 
+    def test_get_list_post_with_cursor(self):
+        with current_app.test_request_context():
+            user1 = User(email='test1@email.com', name='Test 1').save()
+            Post(title='Post 4', body='Body 4', summary='Body 4', author_id=user1.id).save()
+
+        ids, cursor = [], None
+        while True:
+            url = '/posts?per_page=2' + (f'&cursor={cursor}' if cursor else '')
+            resp = self.client.get(url)
+            assert resp.status_code == 200
+            ids.extend(x['id'] for x in resp.json['posts'])
+            cursor = resp.json['next_cursor']
+            if not cursor:
+                break
+        assert ids == sorted(ids, reverse=True)
+        assert len(ids) == len(self.posts) + 1
+
+        resp = self.client.get(f'/posts?per_page=2&author_id={self.user.id}')
+        cursor = resp.json['next_cursor']
+        resp = self.client.get(f'/posts?per_page=2&author_id={self.user.id}&cursor={cursor}')
+        assert resp.status_code == 200
+        assert [x['id'] for x in resp.json['posts']] == [self.posts[0].id]
+        assert resp.json['next_cursor'] is None
+
+    def test_get_list_post_with_invalid_cursor(self):
+        resp = self.client.get('/posts?cursor=invalid')
+        assert resp.status_code == 400
+
+    def test_get_list_post_query_count_does_not_depend_on_authors(self):
+        with current_app.test_request_context():
+            authors = [
+                User(email=f'author{i}@email.com', name=f'Author {i}').save()
+                for i in range(50)
+            ]
+            for author in authors:
+                Post(title='Post', body='Body', summary='Body', author_id=author.id).save()
+
+        with self.count_queries() as statements:
+            resp = self.client.get('/posts?per_page=50')
+
+        assert resp.status_code == 200
+        assert len(resp.json['posts']) == 50
+        assert len({x['author_name'] for x in resp.json['posts']}) > len(self.posts)
+        assert len(statements) == 1
+
+
+    def test_get_list_post_with_fields(self):
+        with self.count_queries() as statements:
+            resp = self.client.get('/posts?fields=title,author_id')
+
+        assert resp.status_code == 200
+        assert resp.json['posts'][0] == {'id': self.posts[2].id, 'title': 'Post 3', 'author_id': self.user.id}
+        assert 'posts.summary' not in statements[0]
+        assert 'users' not in statements[0]
+
+        resp = self.client.get('/posts?fields=title,unknown')
+        assert resp.status_code == 400
+        assert resp.json['message'] == 'Unknown fields: unknown'
+
+    def test_get_specify_post_with_fields(self):
+        post = self.posts[1]
+
+        with self.count_queries() as statements:
+            resp = self.client.get(f'/posts/{post.id}?fields=title,like_string')
+
+        assert resp.status_code == 200
+        assert resp.json['data'] == {'id': post.id, 'title': 'Post 2', 'like_string': ''}
+        assert 'posts.body' not in statements[0]
+        assert 'users' not in statements[0]
+
+        # cached apart from the other fieldsets
+        resp = self.client.get(f'/posts/{post.id}')
+        assert resp.json['data']['body'] == 'Body 2'
+        assert resp.json['data']['author']['name'] == 'Test'
+        assert self.client.get(f'/posts/{post.id}?fields=like_string,title').json == \
+            {'data': {'id': post.id, 'title': 'Post 2', 'like_string': ''}}
+
+
+class ConditionalGetPostAPITestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.users = [
+                User(email='user1@email.com', name='User 1').save(),
+                User(email='user2@email.com', name='User 2').save(),
+            ]
+            self.post = Post(title='Post 1', body='Body 1', summary='Body 1',
+                             author_id=self.users[0].id).save()
+
+    def like(self, user):
+        with current_app.test_request_context():
+            Like(user_id=user.id, post_id=self.post.id).save()
+            likes.add_delta(self.post.id, 1)
+
+    def check_revalidation(self, url):
+        resp = self.client.get(url)
+        assert resp.status_code == 200
+        assert resp.headers['Cache-Control'] == current_app.config['POST_CACHE_CONTROL']
+        etag = resp.headers['ETag']
+        last_modified = resp.headers['Last-Modified']
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+        assert resp.data == b''
+        assert resp.headers['ETag'] == etag
+
+        resp = self.client.get(url, headers={'If-Modified-Since': last_modified})
+        assert resp.status_code == 304
+
+        self.like(self.users[1])
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+        assert 'User 2 liked this post.' in resp.data.decode()
+
+    def test_list(self):
+        self.check_revalidation('/posts')
+
+    def test_detail(self):
+        self.check_revalidation(f'/posts/{self.post.id}')
+
+    def test_detail_not_modified_from_cache(self):
+        etag = self.client.get(f'/posts/{self.post.id}').headers['ETag']
+
+        with self.count_queries() as statements:
+            resp = self.client.get(f'/posts/{self.post.id}', headers={'If-None-Match': etag})
+
+        assert resp.status_code == 304
+        assert statements == []
+
+    def test_edit_changes_etag(self):
+        etag = self.client.get('/posts').headers['ETag']
+
+        with current_app.test_request_context():
+            post = Post.query.get(self.post.id)
+            post.title = 'Post 1 edited'
+            post.save()
+
+        resp = self.client.get('/posts', headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert resp.json['posts'][0]['title'] == 'Post 1 edited'
+
+    def test_like_time_expires(self):
+        self.like(self.users[1])
+        key = f'likes:touched:{self.post.id}'
+        assert 0 < auth.redis.ttl(key) <= current_app.config['LIKES_TOUCHED_TTL']
+        liked = self.client.get('/posts').headers['Last-Modified']
+
+        auth.redis.delete(key)
+        resp = self.client.get('/posts', headers={'If-Modified-Since': liked})
+        assert resp.status_code == 304
+
+
+class SearchPostAPITestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.user = User(email='test@email.com', name='Test').save()
+
+            self.posts = [
+                Post(title='Cooking rice', body='How to cook rice', summary='How to cook rice', author_id=self.user.id).save(),
+                Post(title='Gardening', body='Rice grows in paddies', summary='Rice grows in paddies', author_id=self.user.id).save(),
+                Post(title='Travel', body='Rice terraces and rice wine', summary='Rice terraces and rice wine', author_id=self.user.id).save(),
+                Post(title='Unrelated', body='Nothing here', summary='Nothing here', author_id=self.user.id).save(),
+            ]
+
+    def test_search(self):
+        with self.count_queries() as statements:
+            resp = self.client.get('/posts/search?q=rice')
+
+        assert resp.status_code == 200
+        ids = [post['id'] for post in resp.json['posts']]
+        assert sorted(ids) == [post.id for post in self.posts[:3]]
+        # title matches rank first
+        assert ids[0] == self.posts[0].id
+        assert resp.json['posts'][0] == {
+            'id': self.posts[0].id,
+            'title': 'Cooking rice',
+            'summary': 'How to cook rice',
+            'like_string': '',
+            'author_id': self.user.id,
+            'author_name': 'Test',
+        }
+        assert len(statements) == 1
+
+    def test_search_with_cursor(self):
+        ids = []
+        cursor = None
+        while True:
+            params = {'q': 'rice', 'per_page': 1}
+            if cursor:
+                params['cursor'] = cursor
+            resp = self.client.get('/posts/search', query_string=params)
+            assert resp.status_code == 200
+            ids += [post['id'] for post in resp.json['posts']]
+            cursor = resp.json['next_cursor']
+            if not cursor:
+                break
+
+        assert ids == [post['id'] for post in self.client.get('/posts/search?q=rice').json['posts']]
+
+    def test_search_follows_updates(self):
+        with current_app.test_request_context():
+            post = Post.query.get(self.posts[3].id)
+            post.title = 'Noodles'
+            post.save()
+
+        assert self.client.get('/posts/search?q=unrelated').json['posts'] == []
+        assert [p['id'] for p in self.client.get('/posts/search?q=noodles').json['posts']] == [post.id]
+
+    def test_search_invalid(self):
+        assert self.client.get('/posts/search').status_code == 400
+        assert self.client.get('/posts/search?q=%22*').status_code == 400
+
+        resp = self.client.get('/posts/search', query_string={'q': 'cook* "rice -'})
+        assert resp.status_code == 200
+        assert [post['id'] for post in resp.json['posts']] == [self.posts[0].id]
+
+        resp = self.client.get('/posts/search', query_string={'q': 'rice', 'per_page': 0})
+        assert resp.status_code == 200
+        assert len(resp.json['posts']) == 1
+
 
 class CreatePostAPITestCase(APITestCase):
     def setUp(self):
@@ -75,7 +299,7 @@ class CreatePostAPITestCase(APITestCase):
             }, key=current_app.config['SECRET_KEY'], algorithm='HS256')
 
             self.access_token = token
-            auth.redis.sadd('alive_token', token)
+            auth.token_store.add(token, self.user.id, auth.ACCESS_TOKEN_LIFETIME)
 
     def test_create_post_with_access_token(self):
         payload = {
@@ -91,6 +315,68 @@ class CreatePostAPITestCase(APITestCase):
         assert post.body == payload['body']
         assert post.author_id == self.user.id
 
+    def test_create_posts_in_batch(self):
+        long_body = 'x' * 250
+        payload = {'posts': [
+            {'title': 'Post 1', 'body': 'Body 1'},
+            {'title': 'Post 2'},
+            {'title': 'Post 3', 'body': long_body},
+            'Post 4',
+        ]}
+        with self.count_queries() as statements:
+            resp = self.client.post('/posts/batch', json=payload,
+                                    headers={'authorization': f'Bearer {self.access_token}'})
+
+        assert resp.status_code == 201
+        ids = resp.json['data']['ids']
+        assert ids[1] is None and ids[3] is None
+        assert resp.json['data']['errors'] == [
+            {'index': 1, 'message': 'Body is required'},
+            {'index': 3, 'message': 'Post must be an object'},
+        ]
+        assert len([s for s in statements if s.startswith('INSERT')]) == 1
+
+        first, third = Post.query.get(ids[0]), Post.query.get(ids[2])
+        assert (first.title, first.body, first.author_id) == ('Post 1', 'Body 1', self.user.id)
+        assert third.title == 'Post 3'
+        assert third.summary == long_body[:200] + '...'
+
+    def test_create_posts_in_batch_invalid(self):
+        headers = {'authorization': f'Bearer {self.access_token}'}
+
+        resp = self.client.post('/posts/batch', json={'posts': [{'title': 'Post 1'}]}, headers=headers)
+        assert resp.status_code == 400
+        assert resp.json['data']['ids'] == [None]
+        assert Post.query.count() == 0
+
+        current_app.config['POST_BATCH_LIMIT'] = 2
+        resp = self.client.post('/posts/batch', json={'posts': [{'title': 'Post', 'body': 'Body'}] * 3}, headers=headers)
+        assert resp.status_code == 400
+        assert resp.json['message'] == 'At most 2 posts can be created at once'
+
+        resp = self.client.post('/posts/batch', json={'posts': []})
+        assert resp.status_code == 401
+
+    def test_create_posts_in_batch_checks_values(self):
+        payload = {'posts': [
+            {'title': ['Post 1'], 'body': 'Body 1'},
+            {'title': 'Post 2', 'body': 2},
+            {'title': 'x' * 101, 'body': 'Body 3'},
+            {'title': 'Post 4', 'body': 'x' * 1501},
+            {'title': 'Post 5', 'body': 'Body 5'},
+        ]}
+        resp = self.client.post('/posts/batch', json=payload,
+                                headers={'authorization': f'Bearer {self.access_token}'})
+
+        assert resp.status_code == 201
+        assert resp.json['data']['errors'] == [
+            {'index': 0, 'message': 'Title must be a string'},
+            {'index': 1, 'message': 'Body must be a string'},
+            {'index': 2, 'message': 'Title must be at most 100 characters'},
+            {'index': 3, 'message': 'Body must be at most 1500 characters'},
+        ]
+        assert Post.query.get(resp.json['data']['ids'][4]).title == 'Post 5'
+
 
 class GetLikeTestCase(APITestCase):
     def setUp(self):
@@ -117,8 +403,229 @@ class GetLikeTestCase(APITestCase):
         assert resp.status_code == 200
         assert sorted([x['name'] for x in resp.json['users']]) == sorted([x.name for x in self.users])
 
+    def test_get_list_liked_user_with_cursor(self):
+        resp = self.client.get(f'/posts/{self.post.id}/likes?per_page=2')
+        assert [x['name'] for x in resp.json['users']] == ['User 1', 'User 2']
+
+        resp = self.client.get(f'/posts/{self.post.id}/likes?per_page=2&cursor={resp.json["next_cursor"]}')
+        assert [x['name'] for x in resp.json['users']] == ['User 3']
+        assert resp.json['next_cursor'] is None
+
+        for per_page in (0, -1):
+            resp = self.client.get(f'/posts/{self.post.id}/likes?per_page={per_page}')
+            assert [x['name'] for x in resp.json['users']] == ['User 1']
+
+    def test_stream_list_liked_user(self):
+        resp = self.client.get(f'/posts/{self.post.id}/likes?stream=1')
+
+        assert resp.status_code == 200
+        assert resp.mimetype == 'application/x-ndjson'
+        users = [json.loads(line) for line in resp.data.decode().splitlines()]
+        assert users == [{'id': x.id, 'name': x.name} for x in self.users]
+
     def test_get_like_string(self):
         resp = self.client.get(f'/posts/{self.post.id}')
 
         assert resp.status_code == 200
         assert resp.json['data']['like_string'] == 'User 1, User 2, and 1 other people liked this post.'
+
+    def test_like_string_with_missing_names(self):
+        for values, like_string in (
+            ({'second_liker_name': None}, 'User 1, and 2 other people liked this post.'),
+            ({'first_liker_name': None}, '3 people liked this post.'),
+        ):
+            db.session.execute(Post.__table__.update().values(**values))     #pylint:disable=E1101
+            db.session.commit()     #pylint:disable=E1101
+
+            resp = self.client.get('/posts')
+            assert resp.status_code == 200
+            assert resp.json['posts'][0]['like_string'] == like_string
+
+    def test_like_string_reads_no_likes(self):
+        with sqltrace.record() as trace:
+            resp = self.client.get('/posts')
+
+        assert resp.json['posts'][0]['like_string'] == 'User 1, User 2, and 1 other people liked this post.'
+        assert not [x for x in trace.fingerprints if 'FROM likes' in x or 'JOIN likes' in x]
+
+    def test_rebuild_like_summary(self):
+        db.session.execute(Post.__table__.update().values(      #pylint:disable=E1101
+            first_liker_id=None, first_liker_name=None, second_liker_id=None, second_liker_name=None,
+        ))
+        db.session.commit()     #pylint:disable=E1101
+
+        result = current_app.test_cli_runner().invoke(args=['likes', 'rebuild-summary', '--batch-size', '1'])
+        assert result.output == 'Updated the likers of 1 posts\n'
+
+        post = db.session.query(Post).one()     #pylint:disable=E1101
+        assert (post.first_liker_name, post.second_liker_name) == ('User 1', 'User 2')
+
+    def test_author_change_invalidates_cached_post(self):
+        assert self.client.get(f'/posts/{self.post.id}').json['data']['author']['name'] == 'User 1'
+
+        with current_app.test_request_context():
+            user = User.query.get(self.users[0].id)
+            user.name = 'User 1 renamed'
+            user.save()
+
+        assert self.client.get(f'/posts/{self.post.id}').json['data']['author']['name'] == 'User 1 renamed'
+
+    def test_get_specify_post_from_cache(self):
+        resp = self.client.get(f'/posts/{self.post.id}')
+        assert resp.status_code == 200
+
+        with self.count_queries() as statements:
+            cached_resp = self.client.get(f'/posts/{self.post.id}')
+        assert cached_resp.status_code == 200
+        assert cached_resp.data == resp.data
+        assert statements == []
+
+        with current_app.test_request_context():
+            user = User(email='user4@email.com', name='User 4').save()
+            self.post.n_likes = 4
+            self.post.save()
+            Like(user_id=user.id, post_id=self.post.id).save()
+
+        resp = self.client.get(f'/posts/{self.post.id}')
+        assert resp.json['data']['like_string'] == 'User 1, User 2, and 2 other people liked this post.'
+
+        resp = self.client.get('/cache/stats')
+        assert resp.json == {'hits': 1, 'misses': 2, 'evictions': 1}
+
+    def test_get_like_string_in_list_post(self):
+        with current_app.test_request_context():
+            post1 = Post(title='Post 2', body='Body 5',
+                         summary='Body 5', n_likes=1,
+                         author_id=self.users[0].id).save()
+            post2 = Post(title='Post 3', body='Body 6',
+                         summary='Body 6', n_likes=2,
+                         author_id=self.users[0].id).save()
+            post3 = Post(title='Post 4', body='Body 7',
+                         summary='Body 7', author_id=self.users[0].id).save()
+            Like(user_id=self.users[2].id, post_id=post1.id).save()
+            Like(user_id=self.users[1].id, post_id=post2.id).save()
+            Like(user_id=self.users[0].id, post_id=post2.id).save()
+
+        resp = self.client.get('/posts')
+
+        assert resp.status_code == 200
+        like_strings = {x['id']: x['like_string'] for x in resp.json['posts']}
+        assert like_strings == {
+            self.post.id: 'User 1, User 2, and 1 other people liked this post.',
+            post1.id: 'User 3 liked this post.',
+            post2.id: 'User 2, User 1 liked this post.',
+            post3.id: '',
+        }
+
+
+class LikePostAPITestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.users = [
+                User(email='user1@email.com', name='User 1').save(),
+                User(email='user2@email.com', name='User 2').save(),
+            ]
+            self.post = Post(title='Post 1', body='Body 1', summary='Body 1',
+                             author_id=self.users[0].id).save()
+
+            self.headers = []
+            for user in self.users:
+                token = jwt.encode({'id': user.id}, key=current_app.config['SECRET_KEY'],
+                                   algorithm='HS256')
+                auth.token_store.add(token, user.id, auth.ACCESS_TOKEN_LIFETIME)
+                self.headers.append({'authorization': f'Bearer {token}'})
+
+    def get_like_string(self):
+        resp = self.client.get('/posts')
+        return resp.json['posts'][0]['like_string']
+
+    def test_like_is_idempotent(self):
+        url = f'/posts/{self.post.id}/likes'
+        assert self.client.post(url, headers=self.headers[0]).status_code == 201
+        assert self.client.post(url, headers=self.headers[0]).status_code == 200
+        assert self.client.post(url, headers=self.headers[1]).status_code == 201
+
+        assert Like.query.count() == 2
+        assert self.get_like_string() == 'User 1, User 2 liked this post.'
+        assert self.client.get(f'/posts/{self.post.id}').json['data']['like_string'] == \
+            'User 1, User 2 liked this post.'
+
+        assert self.client.delete(url, headers=self.headers[0]).status_code == 200
+        assert self.client.delete(url, headers=self.headers[0]).status_code == 200
+
+        assert Like.query.count() == 1
+        assert self.get_like_string() == 'User 2 liked this post.'
+        assert self.client.get(f'/posts/{self.post.id}').json['data']['like_string'] == \
+            'User 2 liked this post.'
+
+    def test_like_requires_login_and_post(self):
+        assert self.client.post(f'/posts/{self.post.id}/likes').status_code == 401
+        assert self.client.post('/posts/0/likes', headers=self.headers[0]).status_code == 404
+
+    def test_flush_like_counters(self):
+        url = f'/posts/{self.post.id}/likes'
+        for headers in self.headers:
+            self.client.post(url, headers=headers)
+
+        assert Post.query.get(self.post.id).n_likes == 0
+        assert likes.flush() == 1
+        assert Post.query.get(self.post.id).n_likes == 2
+        assert likes.flush() == 0
+        assert self.get_like_string() == 'User 1, User 2 liked this post.'
+
+    def test_flush_is_applied_once(self):
+        url = f'/posts/{self.post.id}/likes'
+        for headers in self.headers:
+            self.client.post(url, headers=headers)
+
+        # dies between the commit and the DELETE of the flushed deltas
+        with mock.patch.object(auth.redis, 'delete', side_effect=RedisError):
+            with self.assertRaises(RedisError):
+                likes.flush()
+        auth.redis.delete(likes.FLUSH_LOCK_KEY)
+
+        assert likes.flush() == 1
+        db.session.expire_all()     #pylint:disable=E1101
+        assert Post.query.get(self.post.id).n_likes == 2
+        assert self.get_like_string() == 'User 1, User 2 liked this post.'
+
+    def test_flushed_deltas_are_counted_once(self):
+        self.client.post(f'/posts/{self.post.id}/likes', headers=self.headers[0])
+
+        # dies between the commit and the DELETE of the flushed deltas
+        with mock.patch.object(auth.redis, 'delete', side_effect=RedisError):
+            with self.assertRaises(RedisError):
+                likes.flush()
+
+        db.session.expire_all()     #pylint:disable=E1101
+        assert likes.get_like_counts([Post.query.get(self.post.id)]) == {self.post.id: 1}
+        assert self.get_like_string() == 'User 1 liked this post.'
+        resp = self.client.get(f'/posts/{self.post.id}')
+        assert resp.json['data']['like_string'] == 'User 1 liked this post.'
+
+    def test_flush_keeps_the_lock_of_others(self):
+        self.client.post(f'/posts/{self.post.id}/likes', headers=self.headers[0])
+
+        def expire_lock(*args, **kwargs):
+            # the lock expired during the flush and another worker took it
+            auth.redis.set(likes.FLUSH_LOCK_KEY, 'other')
+            return original(*args, **kwargs)
+
+        original = auth.redis.hgetall
+        with mock.patch.object(auth.redis, 'hgetall', side_effect=expire_lock):
+            assert likes.flush() == 1
+        assert auth.redis.get(likes.FLUSH_LOCK_KEY) == b'other'
+
+    def test_like_is_not_cached_before_it_is_counted(self):
+        url = f'/posts/{self.post.id}'
+
+        def add_delta(post_id, delta):
+            # a detail request between the save of the like and its count
+            assert self.client.get(url).json['data']['like_string'] == ''
+            original(post_id, delta)
+
+        original = likes.add_delta
+        with mock.patch.object(likes, 'add_delta', side_effect=add_delta):
+            assert self.client.post(f'{url}/likes', headers=self.headers[0]).status_code == 201
+
+        assert self.client.get(url).json['data']['like_string'] == 'User 1 liked this post.'
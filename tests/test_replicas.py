@@ -0,0 +1,124 @@
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase, mock
+
+import jwt
+import sqlalchemy as sa
+from flask import g
+
+from app import auth, create_app, replicas
+from app.config import TestingConfig
+from app.models import db, User, Post
+from app.replicas import _sticky_key
+
+
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        def uri(name):
+            return 'sqlite:///' + os.path.join(self.directory.name, f'{name}.sqlite3')
+
+        with mock.patch.multiple(
+            TestingConfig,
+            SQLALCHEMY_DATABASE_URI=uri('primary'),
+            SQLALCHEMY_REPLICA_URIS=[uri('replica_0'), uri('replica_1')],
+        ):
+            self.app = create_app('testing')
+
+        self.context = self.app.app_context()
+        self.context.push()
+        self.client = self.app.test_client()
+
+        db.create_all()
+        self.user = User(email='test@email.com', name='Test').save()
+        self.replicas = {}
+        for bind in ('replica_0', 'replica_1'):
+            engine = db.get_engine(self.app, bind=bind)
+            db.Model.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(User.__table__.insert(), {'id': self.user.id, 'email': 'test@email.com', 'name': 'Test'})
+            self.replicas[bind] = engine
+            self.add_post(engine, f'Post of {bind}')
+
+        token = jwt.encode({
+            'id': self.user.id,
+            'iss': datetime.now().timestamp(),
+            'iat': 1000 * 60 * 60 * 24,
+        }, key=self.app.config['SECRET_KEY'], algorithm='HS256')
+        auth.token_store.add(token, self.user.id, auth.ACCESS_TOKEN_LIFETIME)
+        self.headers = {'authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        for engine in self.replicas.values():
+            engine.dispose()
+        db.engine.dispose()
+        self.context.pop()
+        self.directory.cleanup()
+
+    def add_post(self, engine, title):
+        with engine.begin() as conn:
+            conn.execute(Post.__table__.insert(), {
+                'title': title, 'body': 'Body', 'summary': 'Body', 'author_id': self.user.id,
+            })
+
+    def titles(self, **kwargs):
+        resp = self.client.get('/posts', **kwargs)
+        assert resp.status_code == 200
+        return [post['title'] for post in resp.json['posts']]
+
+    def test_round_robin(self):
+        assert self.titles() == ['Post of replica_0']
+        assert self.titles() == ['Post of replica_1']
+        assert self.titles() == ['Post of replica_0']
+
+    def test_read_your_writes(self):
+        resp = self.client.post('/posts', json={'title': 'New post', 'body': 'Body'}, headers=self.headers)
+        assert resp.status_code == 201
+        assert db.session.query(Post.title).all() == [('New post',)]     #pylint:disable=E1101
+
+        # the writer reads from the primary for a while, the others from the replicas
+        assert self.titles(headers=self.headers) == ['New post']
+        assert self.titles() == ['Post of replica_0']
+
+        auth.redis.delete(_sticky_key(self.user.id))
+        assert self.titles(headers=self.headers) == ['Post of replica_1']
+
+    def test_failed_replica_is_skipped(self):
+        with self.replicas['replica_0'].begin() as conn:
+            conn.execute(sa.text('DROP TABLE posts'))
+
+        # retried on the primary within the request
+        assert self.titles() == []
+
+        assert self.titles() == ['Post of replica_1']
+        assert self.titles() == ['Post of replica_1']
+
+        self.app.extensions['replicas'].cooldown = 0
+        assert self.titles() == []
+
+    def test_only_reads_are_retried(self):
+        error = sa.exc.OperationalError('SELECT', {}, Exception('replica is down'))
+        for method, path in (('POST', '/posts'), ('GET', '/auth/logout')):
+            with self.app.test_request_context(path, method=method):
+                g.db_replica = 'replica_0'
+                with self.assertRaises(sa.exc.OperationalError):
+                    replicas.retry_on_primary(error)
+
+    def test_failed_primary_is_not_retried(self):
+        db.session.execute(sa.text('DROP TABLE posts'))     #pylint:disable=E1101
+        db.session.commit()     #pylint:disable=E1101
+        auth.redis.set(_sticky_key(self.user.id), 1)
+
+        with self.assertRaises(sa.exc.OperationalError):
+            self.client.get('/posts', headers=self.headers)
+
+    def test_detail_cache_is_filled_from_primary(self):
+        post = Post(title='Primary post', body='Body', summary='Body', author_id=self.user.id).save()
+
+        resp = self.client.get(f'/posts/{post.id}')
+        assert resp.status_code == 200
+        assert resp.json['data']['title'] == 'Primary post'
@@ -0,0 +1,81 @@
+import json
+import uuid
+from collections import namedtuple
+from dataclasses import dataclass
+from datetime import date, datetime, timezone, timedelta
+from unittest import mock
+
+from flask import current_app
+
+from app import serialization
+from app.models import db, User, Post
+from . import APITestCase
+
+
+@dataclass
+class Author:
+    id: int
+    name: str
+
+
+Pair = namedtuple('Pair', 'first second')
+
+
+class SerializationTestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.user = User(email='test@email.com', name='Test').save()
+            self.post = Post(title='Post 1', body='Body 1', summary='Body 1', author_id=self.user.id).save()
+
+    def sample(self):
+        return {
+            'naive': datetime(2021, 3, 1, 12, 30, 5),
+            'micro': datetime(2021, 3, 1, 12, 30, 5, 120),
+            'aware': datetime(2021, 3, 1, 12, 30, 5, tzinfo=timezone(timedelta(hours=7))),
+            'day': date(2021, 3, 1),
+            'uuid': uuid.UUID('12345678123456781234567812345678'),
+            'author': Author(1, 'Test'),
+            'pair': Pair(1, 2),
+            'row': db.session.query(User.id, User.name).first(),    #pylint:disable=E1101
+            'counts': {2: [None, True, 1.5, 'text'], 1: []},
+        }
+
+    def test_backends_are_identical(self):
+        stdlib = serialization.StdlibBackend()
+        fast = serialization.get_backend('orjson')
+
+        assert stdlib.dumps(self.sample()) == fast.dumps(self.sample())
+        assert stdlib.dumps(self.sample(), pretty=True) == fast.dumps(self.sample(), pretty=True)
+        assert json.loads(stdlib.dumps(self.sample())) == {
+            'aware': '2021-03-01T12:30:05+07:00',
+            'author': {'id': 1, 'name': 'Test'},
+            'counts': {'1': [], '2': [None, True, 1.5, 'text']},
+            'day': '2021-03-01',
+            'micro': '2021-03-01T12:30:05.000120+00:00',
+            'naive': '2021-03-01T12:30:05+00:00',
+            'pair': [1, 2],
+            'row': {'id': self.user.id, 'name': 'Test'},
+            'uuid': '12345678-1234-5678-1234-567812345678',
+        }
+
+    def test_fallback_without_orjson(self):
+        with mock.patch.object(serialization, 'orjson', None):
+            assert serialization.get_backend('auto').name == 'json'
+
+        assert serialization.get_backend('auto').name == 'orjson'
+
+    def test_responses(self):
+        for name in ('json', 'orjson'):
+            current_app.json_backend = serialization.get_backend(name)
+            resp = self.client.get(f'/posts/{self.post.id}')
+            # the cached body of the first request is served to the second one
+            assert self.client.get(f'/posts/{self.post.id}').data == resp.data
+
+            assert resp.status_code == 200
+            assert resp.mimetype == 'application/json'
+            assert resp.data.endswith(b'}\n')
+            assert resp.json['data']['created_at'] == self.post.created_at.isoformat() + '+00:00'
+
+            resp = self.client.get('/posts/0')
+            assert resp.status_code == 404
+            assert resp.json == {'message': 'Post not found'}
@@ -0,0 +1,65 @@
+from flask import current_app
+
+from app.models import Post, User
+from app.sqltrace import QueryBudgetExceeded, fingerprint
+from . import APITestCase
+
+
+class SQLTraceTestCase(APITestCase):
+    def setUp(self):
+        with current_app.test_request_context():
+            self.users = [
+                User(email=f'test{i}@email.com', name=f'Test {i}').save()
+                for i in range(3)
+            ]
+            for user in self.users:
+                Post(title='Post', body='Body', summary='Body', author_id=user.id).save()
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM users\n WHERE id IN (?, ?, ?) AND name = 'a''b' LIMIT 10"),
+            'SELECT * FROM users WHERE id IN (?) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(
+            fingerprint('SELECT * FROM posts WHERE posts.id = %(id_1)s'),
+            fingerprint('SELECT * FROM posts WHERE posts.id = ?'),
+        )
+
+    def test_count_header(self):
+        resp = self.client.get('/posts')
+
+        self.assertEqual(resp.status_code, 200)
+        # no post has likes, so no like string query
+        self.assertEqual(resp.headers['X-SQL-Count'], '1')
+
+    def test_repeated_statement(self):
+        def authors():
+            return {'names': [
+                User.query.filter_by(id=post.author_id).first().name
+                for post in Post.query.all()
+            ]}
+
+        current_app.add_url_rule('/authors', 'authors', authors)
+
+        with self.assertRaisesRegex(QueryBudgetExceeded, '3 times SELECT users.id'):
+            self.client.get('/authors')
+
+    def test_over_budget(self):
+        current_app.config['SQL_BUDGETS'] = {'post.post_view': 0}
+
+        with self.assertRaisesRegex(QueryBudgetExceeded, '1 SQL statements, budget is 0'):
+            self.client.get('/posts')
+
+    def test_query_budget(self):
+        with self.assertQueryBudget(1, repeat_threshold=2):
+            self.client.get('/posts')
+
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(1):
+                self.client.get('/posts')
+                self.client.get('/posts')
+
+
+def test_query_budget_fixture(client, query_budget):
+    with query_budget(1):
+        client.get('/posts')